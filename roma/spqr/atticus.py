@@ -30,6 +30,22 @@ def ordinal(n):
   return '{}{}'.format(n, 'tsnrhtdd'[n%5*(n%100^15>4>n%10)::4])
 
 
+def readable_size(num_bytes, decimals=1):
+  """Convert a number of bytes to a human readable string, e.g., 1.5 KB.
+
+  :param num_bytes: a non-negative integer
+  :param decimals: number of decimals for units larger than byte
+  :return: the corresponding human readable string
+  """
+  censor.check_type(num_bytes, int)
+  if num_bytes < 1024: return '{} B'.format(num_bytes)
+  size = float(num_bytes)
+  for unit in ('KB', 'MB', 'GB', 'TB', 'PB'):
+    size /= 1024
+    if size < 1024 or unit == 'PB': break
+  return '{:.{}f} {}'.format(size, decimals, unit)
+
+
 if __name__ == '__main__':
   for n in range(150): print(ordinal(n))
 
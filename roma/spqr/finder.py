@@ -14,16 +14,135 @@
 # ====-=====================================================================-==
 """This module provides methods for manipulating files"""
 from ..console.console import console
+from ..spqr import atticus
+from ..spqr.table import Table
 from fnmatch import fnmatch
+from fnmatch import translate as fnmatch_translate
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+
+import bz2
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import mmap
 import os
+import pickle
 import re
+import select
+import shutil
+import struct
+import sys
+import threading
+import time
 import zipfile
+import zlib
+
+
+# Tolerance of mtime comparison, since some file systems truncate mtime
+_MTIME_TOLERANCE_NS = 10 ** 6
+
+# Files larger than this size are hashed through mmap
+_MMAP_THRESHOLD = 4 * 1024 * 1024
+
+
+class PathFilter(object):
+  """Compiled include/ignore filter for base names. All fnmatch patterns are
+  translated into regular expressions and combined once, literal names are
+  put into a set, so that each name can be matched in constant time no matter
+  how many patterns are given. A filter can be created once and passed to
+  `walk`, `iwalk`, `zip_dir`, `tree` and `synchronize` via `path_filter`.
+
+  Example:
+
+      path_filter = PathFilter('*.py', ignored_patterns=('test_*', 'build'))
+      walk(root, type_filter='file', recursive=True, path_filter=path_filter)
+  """
+
+  # fnmatch is case-insensitive on case-insensitive file systems
+  _FLAGS = re.IGNORECASE if os.path.normcase('A') != 'A' else 0
+
+  def __init__(self, pattern=None, ignored_patterns=(), re_pattern=None,
+               ignore_hidden_directories=True):
+    """
+    :param pattern: patterns to be included using fnmatch
+    :param ignored_patterns: patterns to be ignored using fnmatch
+    :param re_pattern: patterns to be included using regular expression
+    :param ignore_hidden_directories: whether to ignore hidden directories
+    """
+    if isinstance(ignored_patterns, str): ignored_patterns = ignored_patterns,
+    assert isinstance(ignored_patterns, (tuple, list))
+    if ignore_hidden_directories:
+      ignored_patterns = list(ignored_patterns) + ['.*']
+
+    self.pattern = pattern
+    self.ignored_patterns = tuple(ignored_patterns)
+    self.re_pattern = re_pattern
+
+    # Compile patterns
+    self._included_names, self._include = self._compile(
+      () if pattern is None else (pattern,))
+    self._ignored_names, self._ignore = self._compile(self.ignored_patterns)
+    self._re = None if re_pattern is None else re.compile(re_pattern)
+
+  # region: Private Methods
+
+  def _normcase(self, name):
+    return name.lower() if self._FLAGS else name
+
+  def _compile(self, patterns):
+    """Split `patterns` into a set of literal names and one combined regular
+    expression for the others."""
+    names = set()
+    wildcards = []
+    for ptn in patterns:
+      if any([c in ptn for c in '*?[']): wildcards.append(ptn)
+      else: names.add(self._normcase(ptn))
+    if len(wildcards) == 0: return names, None
+    regex = '|'.join(['(?:{})'.format(fnmatch_translate(ptn))
+                      for ptn in wildcards])
+    return names, re.compile(regex, self._FLAGS).match
+
+  # endregion: Private Methods
+
+  # region: Public Methods
+
+  def traversable(self, name) -> bool:
+    """Whether a directory with base name `name` should be walked into"""
+    if self._ignored_names and self._normcase(name) in self._ignored_names:
+      return False
+    if self._ignore is not None and self._ignore(name) is not None:
+      return False
+    return self._re is None or self._re.match(name) is not None
+
+  def includes(self, name) -> bool:
+    """Whether a path with base name `name` should be included"""
+    if self.pattern is not None:
+      if self._normcase(name) not in self._included_names and (
+          self._include is None or self._include(name) is None): return False
+    return self.traversable(name)
+
+  @classmethod
+  def get(cls, path_filter=None, pattern=None, ignored_patterns=(),
+          re_pattern=None, ignore_hidden_directories=True):
+    """Return `path_filter` if provided, otherwise compile a new one"""
+    if path_filter is not None:
+      assert isinstance(path_filter, PathFilter)
+      return path_filter
+    return cls(pattern, ignored_patterns, re_pattern,
+               ignore_hidden_directories=ignore_hidden_directories)
+
+  # endregion: Public Methods
 
 
 def walk(root_path, type_filter=None, pattern=None, ignored_patterns=(),
          re_pattern=None, return_basename=False, recursive=False,
-         ignore_hidden_directories=True, include_folder_name=False) -> list:
+         ignore_hidden_directories=True, include_folder_name=False,
+         path_filter=None, workers=None) -> list:
   """Traverse through all files/folders under given `root_path`
 
   :param root_path: directory to be traversed
@@ -40,80 +159,505 @@ def walk(root_path, type_filter=None, pattern=None, ignored_patterns=(),
   :param ignore_hidden_directories: whether to ignore hidden directories
   :param include_folder_name: whether to include folder name when `type_filter`
                               is `file`. Designed for `tree` method
+  :param path_filter: a `PathFilter` compiled in advance. If provided,
+                      `pattern`, `ignored_patterns`, `re_pattern` and
+                      `ignore_hidden_directories` will be ignored
+  :param workers: if provided, sub-directories will be listed concurrently
+                  by a `ParallelWalker` with `workers` threads
   :return: a list of paths
   """
-  # Sanity check
-  if not os.path.exists(root_path): raise FileNotFoundError(
-    '!! Directory `{}` does not exist.'.format(root_path))
+  if return_basename and recursive: raise AssertionError(
+    '!! Can not return base name when traversing recursively')
 
-  # Get all paths under root_path
-  paths = [os.path.join(root_path, p).replace('\\', '/')
-           for p in os.listdir(root_path)]
+  _iwalk_func = iwalk if workers is None else ParallelWalker(workers).iwalk
+  paths = list(_iwalk_func(
+    root_path, type_filter=type_filter, pattern=pattern,
+    ignored_patterns=ignored_patterns, re_pattern=re_pattern,
+    recursive=recursive, ignore_hidden_directories=ignore_hidden_directories,
+    include_folder_name=include_folder_name, path_filter=path_filter))
 
-  # Sort paths to avoid the inconsistency between Windows and Linux
-  paths = sorted(paths)
+  # Return if required
+  if return_basename: return [os.path.basename(p) for p in paths]
+  return paths
 
-  # Define filter function
-  def filter_out(f, filter_full_path=False):
-    if not callable(f): return paths
-    _f = f if filter_full_path else lambda p: f(os.path.basename(p))
-    return list(filter(_f, paths))
 
-  # Filter path
+def iwalk(root_path, type_filter=None, pattern=None, ignored_patterns=(),
+          re_pattern=None, recursive=False, ignore_hidden_directories=True,
+          include_folder_name=False, path_filter=None):
+  """Generator version of `walk`. Each directory is listed only once using
+  `os.scandir`, and the type information cached in `os.DirEntry` is reused
+  so that no extra stat calls are required. Paths are yielded as soon as
+  they are found, in exactly the same order as returned by `walk`.
+
+  See `walk` for the description of arguments.
+
+  :return: a generator of paths
+  """
+  entries = _iwalk_entries(
+    root_path, type_filter=type_filter, pattern=pattern,
+    ignored_patterns=ignored_patterns, re_pattern=re_pattern,
+    recursive=recursive, ignore_hidden_directories=ignore_hidden_directories,
+    include_folder_name=include_folder_name, path_filter=path_filter)
+  return (p for p, _ in entries)
+
+
+def _iwalk_entries(root_path, type_filter=None, pattern=None,
+                   ignored_patterns=(), re_pattern=None, recursive=False,
+                   ignore_hidden_directories=True, include_folder_name=False,
+                   path_filter=None, list_dir=None, max_depth=None,
+                   follow_symlinks=True):
+  """Check arguments and return a generator of (path, entry) tuples, in which
+  `entry` is the corresponding `os.DirEntry`. Arguments are checked eagerly
+  so that errors are raised before the generator is consumed. Directories
+  are listed by `list_dir`, which is `_list_dir` by default. If `max_depth`
+  is provided, directories at that depth will not be walked into, and will
+  be treated as folders containing targets. If `follow_symlinks` is False,
+  symbolic links to directories will not be walked into.
+  """
+  # Sanity check
+  if not os.path.exists(root_path): raise FileNotFoundError(
+    '!! Directory `{}` does not exist.'.format(root_path))
+
+  # Get type filter
   if type_filter in ('file', os.path.isfile):
-    type_filter = os.path.isfile
+    type_filter = lambda e: e.is_file()
   elif type_filter in ('folder', 'dir', os.path.isdir):
-    type_filter = os.path.isdir
+    type_filter = lambda e: e.is_dir()
   elif type_filter is not None: raise ValueError(
     '!! `type_filter` should be one of (`file`, `folder`, `dir`)')
-  paths = filter_out(type_filter, filter_full_path=True)
 
-  # Include pattern using fnmatch if necessary
-  if pattern is not None:
-    paths = filter_out(lambda p: fnmatch(p, pattern))
+  # Compile patterns once for the whole walk
+  path_filter = PathFilter.get(
+    path_filter, pattern, ignored_patterns, re_pattern,
+    ignore_hidden_directories=ignore_hidden_directories)
 
-  # Ignore patterns using fnmatch if necessary
-  if isinstance(ignored_patterns, str): ignored_patterns = ignored_patterns,
-  assert isinstance(ignored_patterns, (tuple, list))
-  if ignore_hidden_directories:
-    ignored_patterns = list(ignored_patterns) + ['.*']
-  if len(ignored_patterns) > 0:
-    paths = filter_out(
-      lambda p: not any([fnmatch(p, ptn) for ptn in ignored_patterns]))
+  if list_dir is None: list_dir = _list_dir
+  return _iwalk(root_path, type_filter, path_filter, recursive,
+                include_folder_name, list_dir, max_depth, follow_symlinks)
 
-  # Filter pattern using regular expression if necessary
-  if re_pattern is not None:
-    paths = filter_out(lambda p: re.match(re_pattern, p) is not None)
 
-  # Return if required
-  if return_basename:
-    if recursive: raise AssertionError(
-      '!! Can not return base name when traversing recursively')
-    return [os.path.basename(p) for p in paths]
-
-  # Traverse sub-folders if required
-  _walk = lambda p, t, r, ptn=None: walk(
-    p, type_filter=t, pattern=ptn, re_pattern=re_pattern,
-    ignored_patterns=ignored_patterns, return_basename=False, recursive=r,
-    include_folder_name=include_folder_name)
-  if recursive:
-    for p in _walk(root_path, 'dir', False):
-      # Walk into `p` first, if no targets found, skip
-      sub_paths = _walk(p, type_filter, True, ptn=pattern)
-      if len(sub_paths) == 0: continue
-
-      if p in paths:
-        paths.remove(p)
-        paths.append(p)
-      if p not in paths and include_folder_name:
-        paths.append(p)
-      paths.extend(sub_paths)
-  return paths
+def _list_dir(dir_path):
+  """List `dir_path` using `os.scandir`.
+
+  :return: a list of (path, entry) tuples sorted by path
+  """
+  with os.scandir(dir_path) as it:
+    items = [(os.path.join(dir_path, e.name).replace('\\', '/'), e)
+             for e in it]
+  # Sort paths to avoid the inconsistency between Windows and Linux
+  items.sort(key=lambda item: item[0])
+  return items
+
+
+def _is_dir(entry, follow_symlinks=True) -> bool:
+  # Entries restored from `Index` do not accept `follow_symlinks`
+  if follow_symlinks: return entry.is_dir()
+  return entry.is_dir(follow_symlinks=False)
+
+
+def _iwalk(dir_path, type_filter, path_filter, recursive, include_folder_name,
+           list_dir, max_depth=None, follow_symlinks=True):
+  """Engine of `iwalk`. Entries under `dir_path` passing the filters are
+  yielded in order, except for sub-directories containing targets, which are
+  moved to the end, each followed by its own targets. Each sub-directory is
+  peeked so that only the non-empty ones are deferred.
+  """
+  deferred = []
+  for p, e in list_dir(dir_path):
+    matched = ((type_filter is None or type_filter(e))
+               and path_filter.includes(e.name))
+
+    # Walk into `p` first, if targets are found, defer `p`
+    if (recursive and _is_dir(e, follow_symlinks)
+        and path_filter.traversable(e.name)):
+      if max_depth is not None and max_depth <= 1:
+        deferred.append((p, e, matched, None, ()))
+        continue
+      sub_entries = _iwalk(
+        p, type_filter, path_filter, True, include_folder_name, list_dir,
+        None if max_depth is None else max_depth - 1, follow_symlinks)
+      first = next(sub_entries, None)
+      if first is not None:
+        deferred.append((p, e, matched, first, sub_entries))
+        continue
+
+    if matched: yield p, e
+
+  for p, e, matched, first, sub_entries in deferred:
+    if matched or include_folder_name: yield p, e
+    if first is not None: yield first
+    yield from sub_entries
+
+
+class ParallelWalker(object):
+  """Walker listing sub-directories concurrently on a bounded thread pool.
+  Once a directory is listed, listing of all its traversable sub-directories
+  will be submitted to the pool, while paths are still yielded by the
+  calling thread in the same order as `walk`. This helps a lot on file
+  systems with high latency, e.g., NFS.
+
+  Example:
+
+      walker = ParallelWalker(workers=16)
+      paths = walker.walk(root, type_filter='file', recursive=True)
+      walker.show_report()
+  """
+
+  def __init__(self, workers=8, stat=False):
+    """
+    :param workers: number of listing threads
+    :param stat: whether to call `lstat` on files in listing threads, so
+                 that `entry.stat(follow_symlinks=False)` is cached when
+                 entries are yielded
+    """
+    assert isinstance(workers, int) and workers > 0
+    self.workers = workers
+    self.stat = stat
+
+    # Statistics of the latest walk
+    self.dirs = 0
+    self.entries = 0
+    self.elapsed = 0.
+
+    self._lock = threading.Lock()
+
+  # region: Properties
+
+  @property
+  def dirs_per_second(self):
+    return self.dirs / self.elapsed if self.elapsed > 0 else 0.
+
+  @property
+  def entries_per_second(self):
+    return self.entries / self.elapsed if self.elapsed > 0 else 0.
+
+  # endregion: Properties
+
+  # region: Private Methods
+
+  def _list_dir(self, dir_path, executor, futures, path_filter,
+                follow_symlinks=True):
+    items = _list_dir(dir_path)
+    if self.stat:
+      for _, e in items:
+        if not e.is_dir(follow_symlinks=False): e.stat(follow_symlinks=False)
+    with self._lock:
+      self.dirs += 1
+      self.entries += len(items)
+      # Prefetch sub-directories
+      for p, e in items:
+        if (e.is_dir(follow_symlinks=follow_symlinks)
+            and path_filter.traversable(e.name)):
+          futures[p] = executor.submit(self._list_dir, p, executor, futures,
+                                       path_filter, follow_symlinks)
+    return items
+
+  def _iwalk(self, root_path, recursive, path_filter, follow_symlinks=True,
+             **kwargs):
+    self.dirs, self.entries, self.elapsed = 0, 0, 0.
+    tic = time.time()
+    executor = ThreadPoolExecutor(max_workers=self.workers)
+    futures = {}
+
+    def list_dir(dir_path):
+      with self._lock: future = futures.pop(dir_path, None)
+      if future is not None: return future.result()
+      return self._list_dir(
+        dir_path, executor, futures, path_filter, follow_symlinks)
+
+    try:
+      yield from _iwalk_entries(
+        root_path, recursive=recursive, path_filter=path_filter,
+        list_dir=list_dir if recursive else _list_dir,
+        follow_symlinks=follow_symlinks, **kwargs)
+    finally:
+      # Pending listings are cancelled if the walk is stopped early
+      executor.shutdown(wait=True, cancel_futures=True)
+    self.elapsed = time.time() - tic
+
+  # endregion: Private Methods
+
+  # region: Public Methods
+
+  def iwalk(self, root_path, type_filter=None, pattern=None,
+            ignored_patterns=(), re_pattern=None, recursive=False,
+            ignore_hidden_directories=True, include_folder_name=False,
+            path_filter=None):
+    """Parallel version of `iwalk`. See `walk` for the description of
+    arguments."""
+    # Sanity check
+    if not os.path.exists(root_path): raise FileNotFoundError(
+      '!! Directory `{}` does not exist.'.format(root_path))
+
+    path_filter = PathFilter.get(
+      path_filter, pattern, ignored_patterns, re_pattern,
+      ignore_hidden_directories=ignore_hidden_directories)
+    entries = self._iwalk(
+      root_path, recursive, path_filter, type_filter=type_filter,
+      include_folder_name=include_folder_name)
+    return (p for p, _ in entries)
+
+  def walk(self, root_path, **kwargs) -> list:
+    """Parallel version of `walk`. See `walk` for the description of
+    arguments, except that `return_basename` is not supported."""
+    return list(self.iwalk(root_path, **kwargs))
+
+  def show_report(self):
+    """Show throughput of the latest walk"""
+    console.show_status(
+      '{} directories and {} entries walked in {:.2f} sec using {} workers '
+      '({:.1f} dirs/s, {:.1f} entries/s)'.format(
+        self.dirs, self.entries, self.elapsed, self.workers,
+        self.dirs_per_second, self.entries_per_second))
+
+  # endregion: Public Methods
+
+
+class _CachedEntry(object):
+  """A light-weight replacement of `os.DirEntry` restored from `Index`"""
+
+  __slots__ = ('name', 'path', '_is_dir', '_is_file')
+
+  def __init__(self, name, path, is_dir, is_file):
+    self.name = name
+    self.path = path
+    self._is_dir = is_dir
+    self._is_file = is_file
+
+  def is_dir(self): return self._is_dir
+
+  def is_file(self): return self._is_file
+
+  def stat(self): return os.stat(self.path)
+
+
+class Index(object):
+  """Persistent directory index. Listing of each directory is cached on disk
+  along with the mtime of that directory, which changes whenever an entry is
+  created, deleted or renamed inside it. A repeat walk only stats each
+  directory and re-lists those whose mtime has changed. Queries follow
+  exactly the semantics of `walk`.
+
+  Example:
+
+      index = Index(root)
+      paths = index.walk(type_filter='file', pattern='*.npz')
+  """
+
+  VERSION = 1
+
+  # Listings of directories modified within this period (in ns) before being
+  # listed are not trusted, since further changes may keep the same mtime
+  RACY_PERIOD = 2 * 10 ** 9
+
+  def __init__(self, root_path, index_path=None, auto_save=True):
+    """
+    :param root_path: directory to be indexed
+    :param index_path: path of the index file. By default it will be put into
+                       `~/.cache/roma/finder` so that writing the index does
+                       not modify `root_path`
+    :param auto_save: whether to save the index after each complete walk
+    """
+    if not os.path.isdir(root_path): raise FileNotFoundError(
+      '!! Directory `{}` does not exist.'.format(root_path))
+    # Normalize root path so that `root` and `root/` share the same keys
+    self.root_path = os.path.normpath(root_path).replace('\\', '/')
+    if index_path is None:
+      key = hashlib.sha1(os.path.abspath(root_path).encode()).hexdigest()
+      index_path = os.path.join(os.path.expanduser('~'), '.cache', 'roma',
+                                'finder', '{}.index'.format(key))
+    self.index_path = index_path
+    self.auto_save = auto_save
+
+    # {dir_path: (mtime_ns, [(name, is_dir, is_file), ...])}
+    self._listings = {}
+    self._dirty = False
+
+    # Statistics of the latest walk
+    self.hits = 0
+    self.misses = 0
+
+    self.load()
+
+  # region: Private Methods
+
+  def _list_dir(self, dir_path):
+    mtime = os.stat(dir_path).st_mtime_ns
+    cached = self._listings.get(dir_path)
+    if cached is not None and cached[0] == mtime:
+      self.hits += 1
+      # Paths are built exactly as `_list_dir` does
+      prefix = os.path.join(dir_path, '').replace('\\', '/')
+      return [(prefix + name, _CachedEntry(name, prefix + name, d, f))
+              for name, d, f in cached[1]]
+
+    # List directory and update cache
+    self.misses += 1
+    tic = time.time_ns()
+    items = _list_dir(dir_path)
+    listing = [(e.name, e.is_dir(), e.is_file()) for _, e in items]
+    if cached is not None: self._forget_sub_dirs(dir_path, cached[1], listing)
+    if tic - mtime < self.RACY_PERIOD: mtime = None
+    self._listings[dir_path] = (mtime, listing)
+    self._dirty = True
+    return items
+
+  def _forget_sub_dirs(self, dir_path, old_listing, new_listing):
+    """Remove listings of sub-directories which no longer exist"""
+    new_dirs = set([name for name, d, _ in new_listing if d])
+    prefix = os.path.join(dir_path, '').replace('\\', '/')
+    removed = [prefix + name for name, d, _ in old_listing
+               if d and name not in new_dirs]
+    if len(removed) == 0: return
+    prefixes = tuple([p + '/' for p in removed])
+    for key in list(self._listings.keys()):
+      if key in removed or key.startswith(prefixes): self._listings.pop(key)
+
+  # endregion: Private Methods
+
+  # region: Public Methods
+
+  def load(self):
+    """Load index from `index_path` if it exists and is compatible"""
+    if not os.path.exists(self.index_path): return
+    try:
+      with open(self.index_path, 'rb') as f: data = pickle.load(f)
+      assert data['version'] == self.VERSION
+      assert data['root_path'] == self.root_path
+      self._listings = data['listings']
+    except Exception:
+      # Corrupted or outdated index files are simply ignored
+      self._listings = {}
+
+  def save(self):
+    """Save index to `index_path` if it has been modified"""
+    if not self._dirty: return
+    os.makedirs(os.path.dirname(os.path.abspath(self.index_path)),
+                exist_ok=True)
+    data = dict(version=self.VERSION, root_path=self.root_path,
+                listings=self._listings)
+    tmp_path = self.index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+      pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, self.index_path)
+    self._dirty = False
+
+  def clear(self):
+    """Forget all cached listings"""
+    self._listings = {}
+    self._dirty = True
+
+  def iwalk(self, type_filter=None, pattern=None, ignored_patterns=(),
+            re_pattern=None, recursive=True, ignore_hidden_directories=True,
+            include_folder_name=False, path_filter=None):
+    """Indexed version of `iwalk`. See `walk` for the description of
+    arguments. Note that `recursive` is True by default."""
+    entries = _iwalk_entries(
+      self.root_path, type_filter=type_filter, pattern=pattern,
+      ignored_patterns=ignored_patterns, re_pattern=re_pattern,
+      recursive=recursive, ignore_hidden_directories=ignore_hidden_directories,
+      include_folder_name=include_folder_name, path_filter=path_filter,
+      list_dir=self._list_dir)
+    self.hits, self.misses = 0, 0
+    for p, _ in entries: yield p
+    if self.auto_save: self.save()
+
+  def walk(self, **kwargs) -> list:
+    """Indexed version of `walk`. See `walk` for the description of
+    arguments, except that `return_basename` is not supported."""
+    return list(self.iwalk(**kwargs))
+
+  # endregion: Public Methods
+
+
+# Files matching these patterns are usually compressed already, thus will be
+# put into ZIP files using ZIP_STORED
+STORED_PATTERNS = (
+  '*.zip', '*.npz', '*.gz', '*.tgz', '*.bz2', '*.xz', '*.7z', '*.rar',
+  '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.mp3', '*.mp4', '*.avi',
+  '*.mkv', '*.pdf',
+)
+
+# Files larger than this size are compressed by the main process in a
+# streaming way instead of being sent to worker processes
+_MAX_PARALLEL_SIZE = 64 * 1024 * 1024
+
+
+def _compress_file(path, compression, compresslevel):
+  """Compress a file for `zip_dir` in a worker process.
+
+  :return: a tuple of (CRC, file size, compressed data)
+  """
+  with open(path, 'rb') as f: data = f.read()
+  crc = zlib.crc32(data)
+  if compression == zipfile.ZIP_DEFLATED:
+    level = zlib.Z_DEFAULT_COMPRESSION if compresslevel is None else (
+      compresslevel)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+  elif compression == zipfile.ZIP_BZIP2:
+    compressed = bz2.compress(data, 9 if compresslevel is None else (
+      compresslevel))
+  else: raise ValueError('!! Unsupported compression `{}`'.format(compression))
+  return crc, len(data), compressed
+
+
+def _write_compressed(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, crc,
+                      file_size, compressed):
+  """Append a member compressed in advance to `zipf`. This is what
+  `ZipFile.write` does after compression."""
+  zinfo.CRC = crc
+  zinfo.file_size = file_size
+  zinfo.compress_size = len(compressed)
+  with zipf._lock:
+    if zipf._seekable: zipf.fp.seek(zipf.start_dir)
+    zinfo.header_offset = zipf.fp.tell()
+    zipf._writecheck(zinfo)
+    zipf._didModify = True
+    zip64 = max(file_size, len(compressed)) > zipfile.ZIP64_LIMIT
+    zipf.fp.write(zinfo.FileHeader(zip64))
+    zipf.fp.write(compressed)
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = zipf.fp.tell()
+
+
+def _write_members(zipf: zipfile.ZipFile, members, compression, compresslevel,
+                   is_stored, workers):
+  """Write (path, arcname) pairs to `zipf` in order. If `workers` is provided,
+  members are compressed on a process pool with a bounded number of members
+  in flight."""
+  if workers is None or compression not in (
+      zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2):
+    for p, arcname in members:
+      zipf.write(p, arcname, zipfile.ZIP_STORED if is_stored(p) else None)
+    return
+
+  def _flush(pending):
+    p, arcname, future = pending.popleft()
+    if future is None:
+      zipf.write(p, arcname, zipfile.ZIP_STORED if is_stored(p) else None)
+      return
+    zinfo = zipfile.ZipInfo.from_file(p, arcname)
+    zinfo.compress_type = compression
+    _write_compressed(zipf, zinfo, *future.result())
+
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    pending = deque()
+    for p, arcname in members:
+      future = None
+      if not is_stored(p) and os.path.getsize(p) <= _MAX_PARALLEL_SIZE:
+        future = executor.submit(_compress_file, p, compression, compresslevel)
+      pending.append((p, arcname, future))
+      if len(pending) >= 2 * workers: _flush(pending)
+    while pending: _flush(pending)
 
 
 def zip_dir(src_path, pattern, ignored_patterns=(), re_pattern=None,
             dst_path=None, overwrite=True, verbose=False,
-            ignore_hidden_directories=True) -> str:
+            ignore_hidden_directories=True, path_filter=None,
+            compression=zipfile.ZIP_DEFLATED, compresslevel=None,
+            stored_patterns=STORED_PATTERNS, workers=None) -> str:
   """Create a ZIP file for all files with given pattern under `scr_path`
 
   :param src_path: source path
@@ -124,13 +668,26 @@ def zip_dir(src_path, pattern, ignored_patterns=(), re_pattern=None,
   :param overwrite: whether to overwrite if .zip file already exists
   :param verbose: whether or not to print processing details
   :param ignore_hidden_directories: whether to ignore hidden directories
+  :param path_filter: a `PathFilter` compiled in advance. If provided,
+                      `pattern`, `ignored_patterns`, `re_pattern` and
+                      `ignore_hidden_directories` will be ignored
+  :param compression: compression method, e.g., zipfile.ZIP_DEFLATED
+  :param compresslevel: compression level, None for the default level
+  :param stored_patterns: files matching any of these patterns (using
+                          fnmatch) will be stored without compression
+  :param workers: if provided, members will be compressed on a process pool
+                  with `workers` processes. Only ZIP_DEFLATED and ZIP_BZIP2
+                  are supported
   :return: path of the created .zip file
   """
+  path_filter = PathFilter.get(
+    path_filter, pattern, ignored_patterns, re_pattern,
+    ignore_hidden_directories=ignore_hidden_directories)
+
   if verbose:
     console.show_status('Creating ZIP file for source directory:')
     console.split(color='yellow')
-    tree(src_path, type_filter='file', pattern=pattern, re_pattern=re_pattern,
-         ignored_patterns=ignored_patterns)
+    tree(src_path, type_filter='file', path_filter=path_filter)
     console.split(color='yellow')
 
   # Check source path
@@ -150,31 +707,126 @@ def zip_dir(src_path, pattern, ignored_patterns=(), re_pattern=None,
   if os.path.exists(src_path) and not overwrite:
     raise FileExistsError('!! ZIP file `{}` already exists.'.format(dst_path))
 
-  # Create zip file
-  file_paths = walk(src_path, type_filter='file', pattern=pattern,
-                    re_pattern=re_pattern, ignored_patterns=ignored_patterns,
-                    ignore_hidden_directories=ignore_hidden_directories,
-                    recursive=True)
-  with zipfile.ZipFile(dst_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-    start = os.path.join(src_path, '..')
-    for p in file_paths: zipf.write(p, os.path.relpath(p, start))
+  # Compile stored patterns
+  stored_match = None
+  if stored_patterns:
+    stored_match = re.compile('|'.join(
+      ['(?:{})'.format(fnmatch_translate(ptn)) for ptn in stored_patterns]),
+      PathFilter._FLAGS).match
+  is_stored = lambda p: (stored_match is not None and
+                         stored_match(os.path.basename(p)) is not None)
+
+  # Create zip file, files are written as soon as they are found
+  file_paths = iwalk(src_path, type_filter='file', recursive=True,
+                     path_filter=path_filter)
+  start = os.path.join(src_path, '..')
+  dst_abs_path = os.path.abspath(dst_path)
+  # Never put the ZIP file being written into itself
+  members = ((p, os.path.relpath(p, start)) for p in file_paths
+             if os.path.abspath(p) != dst_abs_path)
+  with zipfile.ZipFile(dst_path, 'w', compression,
+                       compresslevel=compresslevel) as zipf:
+    _write_members(zipf, members, compression, compresslevel, is_stored,
+                   workers)
 
   # Finalize
   if verbose: console.show_status('ZIP file saved to `{}`.'.format(dst_path))
   return dst_path
 
 
-def unzip_file(zip_path: str, dst_path: str, verbose=False):
-  """Unzip a .zip file to `dst_path`
+def _crc32_file(path, chunk_size=1 << 20) -> int:
+  crc = 0
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+      crc = zlib.crc32(chunk, crc)
+  return crc
+
+
+def _member_target(dst_path, member: zipfile.ZipInfo):
+  """Get the path `member` will be extracted to, in the same way as
+  `ZipFile.extract` does. Note that backslashes are separators only on
+  Windows"""
+  arcname = member.filename.replace('/', os.path.sep)
+  if os.path.altsep: arcname = arcname.replace(os.path.altsep, os.path.sep)
+  # Drive letters, redundant separators, '.' and '..' are removed
+  arcname = os.path.splitdrive(arcname)[1]
+  arcname = os.path.sep.join([p for p in arcname.split(os.path.sep)
+                              if p not in ('', os.path.curdir, os.path.pardir)])
+  if os.path.sep == '\\':
+    arcname = zipfile.ZipFile._sanitize_windows_name(arcname, os.path.sep)
+  return os.path.normpath(os.path.join(dst_path, arcname))
+
+
+def unzip_file(zip_path: str, dst_path: str, verbose=False, pattern=None,
+               ignored_patterns=(), re_pattern=None,
+               ignore_hidden_directories=False, path_filter=None,
+               skip_same=False, workers=None):
+  """Unzip a .zip file to `dst_path`. Members are selected using the same
+  pattern semantics as `walk`, i.e., the base name of a member should be
+  included while none of its parent directories are ignored.
 
   :param zip_path: path of the .zip file to be unzipped
   :param dst_path: destination path
   :param verbose: whether to display processing details
+  :param pattern: patterns to be included using fnmatch
+  :param ignored_patterns: patterns to be ignored using fnmatch
+  :param re_pattern: patterns to be included using regular expression
+  :param ignore_hidden_directories: whether to ignore hidden directories
+  :param path_filter: a `PathFilter` compiled in advance. If provided,
+                      `pattern`, `ignored_patterns`, `re_pattern` and
+                      `ignore_hidden_directories` will be ignored
+  :param skip_same: whether to skip members whose size and CRC32 are the same
+                    as the existing files
+  :param workers: if provided, members will be extracted on a thread pool
   """
   if not zipfile.is_zipfile(zip_path):
     raise FileExistsError('!! Can not find ZIP file `{}`'.format(zip_path))
 
-  with zipfile.ZipFile(zip_path, 'r') as zipf: zipf.extractall(dst_path)
+  path_filter = PathFilter.get(
+    path_filter, pattern, ignored_patterns, re_pattern,
+    ignore_hidden_directories=ignore_hidden_directories)
+
+  def _selected(member: zipfile.ZipInfo):
+    parts = [p for p in member.filename.split('/') if p]
+    if len(parts) == 0: return False
+    if not all([path_filter.traversable(p) for p in parts[:-1]]): return False
+    return path_filter.includes(parts[-1])
+
+  def _same(member: zipfile.ZipInfo):
+    target = _member_target(dst_path, member)
+    return (os.path.isfile(target)
+            and os.path.getsize(target) == member.file_size
+            and _crc32_file(target) == member.CRC)
+
+  with zipfile.ZipFile(zip_path, 'r') as zipf:
+    members = [m for m in zipf.infolist() if _selected(m)]
+    if workers is None:
+      for m in members:
+        if skip_same and not m.is_dir() and _same(m): continue
+        zipf.extract(m, dst_path)
+    else:
+      # Create directories in advance to avoid races between threads
+      for m in members:
+        target = _member_target(dst_path, m)
+        os.makedirs(target if m.is_dir() else os.path.dirname(target),
+                    exist_ok=True)
+
+      # Each thread reads members through its own file handle
+      local = threading.local()
+      handles = []
+
+      def _extract(m: zipfile.ZipInfo):
+        if m.is_dir() or (skip_same and _same(m)): return
+        if not hasattr(local, 'zipf'):
+          local.zipf = zipfile.ZipFile(zip_path, 'r')
+          handles.append(local.zipf)
+        local.zipf.extract(m, dst_path)
+
+      try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+          list(executor.map(_extract, members))
+      finally:
+        for handle in handles: handle.close()
 
   if verbose:
     console.show_status('`{}` unzipped to `{}`'.format(zip_path, dst_path))
@@ -182,9 +834,33 @@ def unzip_file(zip_path: str, dst_path: str, verbose=False):
   return dst_path
 
 
+class _TreeFolder(object):
+  """Folder being rendered by `tree`"""
+
+  __slots__ = ('path', 'name', 'depth', 'visible', 'shown', 'hidden', 'files',
+               'size')
+
+  def __init__(self, path, name, depth, visible):
+    self.path = path
+    self.name = name
+    self.depth = depth
+    self.visible = visible
+    self.shown = 0
+    self.hidden = 0
+    self.files = 0
+    self.size = 0
+
+  @property
+  def summary(self):
+    return '{} file{}, {}'.format(self.files, '' if self.files == 1 else 's',
+                                  atticus.readable_size(self.size))
+
+
 def tree(root_path: str, type_filter=None, pattern=None, ignored_patterns=(),
-         re_pattern=None):
-  """List a directory tree using walk. Example output:
+         re_pattern=None, path_filter=None, max_depth=None, max_entries=None,
+         show_size=False):
+  """List a directory tree using iwalk. Entries are printed as soon as they
+  are found. Example output:
 
   root_path
   |--foo.py
@@ -194,6 +870,14 @@ def tree(root_path: str, type_filter=None, pattern=None, ignored_patterns=(),
   |     |--bar.py
   |- sub-folder-3
 
+  When `max_depth` is 1, `max_entries` is 2 and `show_size` is True:
+
+  root_path
+  |--foo.py
+  |--sub-folder-1 (3 files, 1.2 KB)
+  |--... 2 more
+    (8 files, 2.5 MB)
+
   :param root_path: directory to be traversed
   :param type_filter: specify what type of path should be returned, can be
                       (1) None (default), indicating return all paths
@@ -202,30 +886,940 @@ def tree(root_path: str, type_filter=None, pattern=None, ignored_patterns=(),
   :param pattern: further filter out paths using fnmatch
   :param ignored_patterns: patterns to be ignored using fnmatch
   :param re_pattern: further filter out paths using regular expression
+  :param path_filter: a `PathFilter` compiled in advance. If provided,
+                      `pattern`, `ignored_patterns` and `re_pattern` will be
+                      ignored
+  :param max_depth: folders deeper than this depth will not be expanded
+  :param max_entries: maximum number of entries shown in each folder, the
+                      rest will be summarized as `... N more`
+  :param show_size: whether to show aggregated file counts and sizes of each
+                    folder. Note that sub-folders of collapsed folders will
+                    still be traversed for aggregation
   """
   # Calculate root level
   if root_path[-1] == '/': root_path = root_path[:-1]
   level = lambda p: len(p.split('/'))
   root_level = level(root_path)
-  get_prefix = lambda p: '|  ' * (level(p) - root_level - 1) + '|--'
+  get_prefix = lambda depth: console.fancify('|  ' * (depth - 1) + '|--',
+                                             'white')
+
+  # Recursively get paths along with their cached entries. Walk is limited by
+  # `max_depth` only when aggregation is not required
+  entries = _iwalk_entries(
+    root_path=root_path, type_filter=type_filter, pattern=pattern,
+    ignored_patterns=ignored_patterns, re_pattern=re_pattern, recursive=True,
+    include_folder_name=True, path_filter=path_filter,
+    max_depth=None if show_size else max_depth)
 
-  # Recursively get paths
-  paths = walk(root_path=root_path, type_filter=type_filter, pattern=pattern,
-               ignored_patterns=ignored_patterns, return_basename=False,
-               re_pattern=re_pattern, recursive=True, include_folder_name=True)
+  # Use bold font for directories
+  folder_line = lambda folder, summary: '{}{}{}'.format(
+    get_prefix(folder.depth), console.fancify(folder.name, 'bold'),
+    ' ({})'.format(folder.summary) if summary else '')
+
+  def close(folder: _TreeFolder, parent: _TreeFolder):
+    """Finish rendering a folder whose entries have all been found"""
+    if folder.visible and folder.hidden > 0:
+      console.write_line('{}... {} more'.format(
+        get_prefix(folder.depth + 1), folder.hidden))
+    # Collapsed folders are printed after being aggregated
+    collapsed = max_depth is not None and folder.depth >= max_depth
+    if show_size and folder.visible:
+      if collapsed: console.write_line(folder_line(folder, True))
+      else: console.write_line('{}  ({})'.format(
+        console.fancify('|  ' * folder.depth, 'white'), folder.summary))
+    if parent is not None:
+      parent.files += folder.files
+      parent.size += folder.size
 
   # Print tree
   console.write_line(console.fancify(root_path, 'bold'))
-  for p in paths:
-    prefix = console.fancify(get_prefix(p), 'white')
-    name = os.path.basename(p)
-    # Use bold font for directories
-    if os.path.isdir(p): name = console.fancify(name, 'bold')
-    console.write_line(prefix + name)
+  stack = [_TreeFolder(root_path, root_path, 0, True)]
+  for p, e in entries:
+    depth = level(p) - root_level
+    while stack[-1].depth >= depth: close(stack.pop(), stack[-1])
+    parent = stack[-1]
+
+    # Decide whether this entry should be printed
+    visible = parent.visible and (max_depth is None or depth <= max_depth)
+    if visible and max_entries is not None and parent.shown >= max_entries:
+      parent.hidden += 1
+      visible = False
+    if visible: parent.shown += 1
+
+    if e.is_dir():
+      folder = _TreeFolder(p, e.name, depth, visible)
+      stack.append(folder)
+      if visible and not (show_size and max_depth is not None
+                          and depth >= max_depth):
+        console.write_line(folder_line(folder, False))
+    else:
+      if show_size:
+        parent.files += 1
+        # Symbolic links may be dangling
+        parent.size += e.stat(follow_symlinks=False).st_size
+      if visible: console.write_line(get_prefix(depth) + e.name)
+
+  while len(stack) > 1: close(stack.pop(), stack[-1])
+  close(stack[0], None)
+
+
+def _hash_file(path, algorithm='md5', chunk_size=1 << 20) -> str:
+  """Calculate the hex digest of file content chunk by chunk. Large files are
+  mapped into memory to avoid copying chunks into Python buffers."""
+  h = hashlib.new(algorithm)
+  with open(path, 'rb') as f:
+    size = os.fstat(f.fileno()).st_size
+    if size < _MMAP_THRESHOLD:
+      for chunk in iter(lambda: f.read(chunk_size), b''): h.update(chunk)
+    else:
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        with memoryview(m) as view:
+          for i in range(0, size, chunk_size):
+            h.update(view[i:i + chunk_size])
+  return h.hexdigest()
+
+
+def build_manifest(root_path, path_filter=None, checksum=False,
+                   algorithm='md5', **kwargs) -> dict:
+  """Build a manifest of all files under `root_path` in a single traversal.
+
+  :param root_path: directory to be traversed
+  :param path_filter: a `PathFilter` compiled in advance. If not provided,
+                      one will be compiled using `kwargs`, which may contain
+                      `pattern`, `ignored_patterns`, `re_pattern` and
+                      `ignore_hidden_directories`
+  :param checksum: whether to calculate content hash of each file
+  :param algorithm: hash algorithm used when `checksum` is True
+  :return: a dictionary of {relative_path: (size, mtime_ns, digest)}, in
+           which `digest` is None if `checksum` is False
+  """
+  path_filter = PathFilter.get(path_filter, **kwargs)
+  manifest = {}
+  for p, e in _iwalk_entries(root_path, type_filter='file', recursive=True,
+                             path_filter=path_filter):
+    st = e.stat()
+    digest = _hash_file(p, algorithm) if checksum else None
+    rel_path = os.path.relpath(p, root_path).replace('\\', '/')
+    manifest[rel_path] = (st.st_size, st.st_mtime_ns, digest)
+  return manifest
+
+
+class TreeDigest(object):
+  """Content digests of a directory tree produced by `hash_tree`.
+
+  - `files`: {relative_path: digest} of all files
+  - `dirs`: {relative_path: Merkle digest} of all directories containing
+            files, in which the root directory has relative path ''
+  - `stats`: {relative_path: (size, mtime_ns)} used for cache validation
+  """
+
+  def __init__(self, algorithm):
+    self.algorithm = algorithm
+    self.files = {}
+    self.dirs = {}
+    self.stats = {}
+
+  @property
+  def root(self):
+    """Merkle root of the whole tree"""
+    return self.dirs.get('')
+
+  def __eq__(self, other):
+    return isinstance(other, TreeDigest) and self.root == other.root
+
+  def diff(self, other) -> list:
+    """Return relative paths of files which differ from `other`"""
+    assert isinstance(other, TreeDigest)
+    paths = set(self.files.keys()) | set(other.files.keys())
+    return sorted([p for p in paths
+                   if self.files.get(p) != other.files.get(p)])
+
+  def save(self, path):
+    with open(path, 'wb') as f:
+      pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+  @staticmethod
+  def load(path):
+    with open(path, 'rb') as f: digest = pickle.load(f)
+    assert isinstance(digest, TreeDigest)
+    return digest
+
+
+def hash_tree(root_path, algorithm='sha256', chunk_size=1 << 20, workers=8,
+              cache=None, path_filter=None, **kwargs) -> TreeDigest:
+  """Hash all files under `root_path` on a thread pool and calculate a Merkle
+  digest for each directory. Two directory trees are identical if and only
+  if their Merkle roots are the same.
+
+  :param root_path: directory to be hashed
+  :param algorithm: hash algorithm supported by `hashlib`
+  :param chunk_size: files are hashed chunk by chunk
+  :param workers: number of hashing threads
+  :param cache: a `TreeDigest` from a previous run or path of a saved one.
+                Digests of files with unchanged size and mtime will be
+                reused. If `cache` is a path, the result will be saved to it
+  :param path_filter: a `PathFilter` compiled in advance. If not provided,
+                      one will be compiled using `kwargs`, which may contain
+                      `pattern`, `ignored_patterns`, `re_pattern` and
+                      `ignore_hidden_directories`
+  :return: a `TreeDigest`
+  """
+  path_filter = PathFilter.get(path_filter, **kwargs)
+
+  # Load cache if necessary
+  cache_path = None
+  if isinstance(cache, str):
+    cache_path = cache
+    cache = TreeDigest.load(cache_path) if os.path.exists(cache_path) else None
+  if cache is not None and cache.algorithm != algorithm: cache = None
+
+  # Collect files and reuse cached digests
+  result = TreeDigest(algorithm)
+  to_hash = []
+  for p, e in _iwalk_entries(root_path, type_filter='file', recursive=True,
+                             path_filter=path_filter):
+    st = e.stat()
+    rel_path = os.path.relpath(p, root_path).replace('\\', '/')
+    result.stats[rel_path] = (st.st_size, st.st_mtime_ns)
+    if cache is not None and cache.stats.get(rel_path) == (
+        result.stats[rel_path]):
+      result.files[rel_path] = cache.files[rel_path]
+    else: to_hash.append((rel_path, p))
+
+  # Hash files on a thread pool, `hashlib` releases the GIL on large chunks
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    digests = executor.map(
+      lambda p: _hash_file(p, algorithm, chunk_size), [p for _, p in to_hash])
+    for (rel_path, _), digest in zip(to_hash, digests):
+      result.files[rel_path] = digest
+
+  # Calculate Merkle digests bottom-up
+  children = {}
+  for rel_path, digest in result.files.items():
+    parent, name = os.path.split(rel_path)
+    children.setdefault(parent, []).append(('f', name, digest))
+    # Make sure all ancestors are registered
+    while parent:
+      parent, name = os.path.split(parent)
+      children.setdefault(parent, [])
+  depth = lambda d: len(d.split('/')) if d else 0
+  for dir_path in sorted(children.keys(), key=lambda d: -depth(d)):
+    h = hashlib.new(algorithm)
+    for kind, name, digest in sorted(children[dir_path]):
+      h.update('{} {} {}\n'.format(kind, name, digest).encode())
+    result.dirs[dir_path] = h.hexdigest()
+    if dir_path:
+      parent, name = os.path.split(dir_path)
+      children[parent].append(('d', name, result.dirs[dir_path]))
+
+  if cache_path is not None: result.save(cache_path)
+  return result
+
+
+def copy_file(src_path, dst_path, buffer_size=1 << 20) -> int:
+  """Copy a file along with its metadata. Data is copied inside the kernel
+  using `os.copy_file_range` or `os.sendfile` if possible, otherwise
+  `shutil.copyfileobj` with a large buffer is used.
+
+  :param src_path: source file path
+  :param dst_path: destination file path
+  :param buffer_size: buffer size used by the fallback
+  :return: number of bytes copied
+  """
+  with open(src_path, 'rb') as fsrc, open(dst_path, 'wb') as fdst:
+    size = os.fstat(fsrc.fileno()).st_size
+    copied = 0
+    for name in ('copy_file_range', 'sendfile'):
+      if copied >= size or not hasattr(os, name): continue
+      try:
+        while copied < size:
+          if name == 'copy_file_range':
+            n = os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                   size - copied)
+          else: n = os.sendfile(fdst.fileno(), fsrc.fileno(), None,
+                                size - copied)
+          # Some file systems, e.g., procfs and FUSE, report 0 instead of
+          # failing, in which case the next method will be tried
+          if n == 0: break
+          copied += n
+      except OSError:
+        # Not supported by this file system, offsets of both files have
+        # been advanced by `copied` bytes
+        continue
+    if copied < size:
+      shutil.copyfileobj(fsrc, fdst, buffer_size)
+      fdst.flush()
+      copied = os.fstat(fdst.fileno()).st_size
+    # File may be truncated during copying
+    if copied < size: raise OSError(
+      '!! Only {} of {} bytes are copied from `{}`'.format(
+        copied, size, src_path))
+  shutil.copystat(src_path, dst_path)
+  return copied
+
+
+def copy_files(pairs, workers=4, verbose=False, skip_missing=False) -> int:
+  """Copy files using `copy_file` on a thread pool.
+
+  :param pairs: a list of (src_path, dst_path) tuples
+  :param workers: maximum number of copies in flight
+  :param verbose: whether to show progress
+  :param skip_missing: whether to skip source files which do not exist
+  :return: total number of bytes copied
+  """
+  if skip_missing: pairs = [(src, dst) for src, dst in pairs
+                            if os.path.isfile(src)]
+
+  # Create destination directories in advance to avoid races
+  for _, dst_path in pairs:
+    os.makedirs(os.path.dirname(os.path.abspath(dst_path)), exist_ok=True)
+
+  total_bytes = sum([os.path.getsize(src) for src, _ in pairs])
+  copied = 0
+  tic = time.time()
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    futures = [executor.submit(copy_file, src, dst) for src, dst in pairs]
+    for future in as_completed(futures):
+      try: copied += future.result()
+      except FileNotFoundError:
+        # Source file may be deleted during copying
+        if not skip_missing: raise
+      if verbose and total_bytes > 0:
+        console.print_progress(min(copied, total_bytes), total_bytes, tic)
+  if verbose and total_bytes > 0: console.clear_line()
+  return copied
+
+
+def _hash_head_and_tail(path, size, block_size, algorithm) -> str:
+  """Hash the first and last `block_size` bytes of a file"""
+  h = hashlib.new(algorithm)
+  with open(path, 'rb') as f:
+    h.update(f.read(block_size))
+    if size > block_size:
+      f.seek(max(size - block_size, block_size))
+      h.update(f.read(block_size))
+  return h.hexdigest()
+
+
+def _link_to_temp(src_path, path) -> str:
+  """Create a hard link to `src_path` with a unique name next to `path`"""
+  while True:
+    tmp_path = '{}.{}.roma-link'.format(path, os.urandom(4).hex())
+    try:
+      os.link(src_path, tmp_path)
+      return tmp_path
+    except FileExistsError: continue
+
+
+def find_duplicates(root_path, min_size=1, block_size=4096, algorithm='sha256',
+                    workers=8, hardlink=False, verbose=False, path_filter=None,
+                    **kwargs):
+  """Find duplicate files under `root_path` in stages:
+  (1) group files by size, which costs nothing but the stat during walk;
+  (2) hash the first and last `block_size` bytes of files sharing a size;
+  (3) fully hash files which still collide.
+  Hashing is performed on a thread pool. Hard links to the same inode are
+  regarded as one file.
+
+  :param root_path: directory to be searched
+  :param min_size: files smaller than this size will be ignored
+  :param block_size: size of the head and tail blocks hashed in stage (2)
+  :param algorithm: hash algorithm supported by `hashlib`
+  :param workers: number of hashing threads
+  :param hardlink: whether to replace duplicates with hard links to the first
+                   file in each group
+  :param verbose: whether to show the result
+  :param path_filter: a `PathFilter` compiled in advance. If not provided,
+                      one will be compiled using `kwargs`, which may contain
+                      `pattern`, `ignored_patterns`, `re_pattern` and
+                      `ignore_hidden_directories`
+  :return: a tuple of (groups, reclaimable_bytes), in which `groups` is a
+           list of duplicate path lists sorted by file size in descending
+           order
+  """
+  path_filter = PathFilter.get(path_filter, **kwargs)
+
+  # (1) Group by size, symbolic links are neither followed nor counted
+  by_size = {}
+  inodes = set()
+  for p, e in _iwalk_entries(root_path, type_filter='file', recursive=True,
+                             path_filter=path_filter, follow_symlinks=False):
+    if e.is_symlink(): continue
+    st = e.stat(follow_symlinks=False)
+    if st.st_size < min_size: continue
+    # A file may be reached through more than one path
+    if (st.st_dev, st.st_ino) in inodes: continue
+    inodes.add((st.st_dev, st.st_ino))
+    by_size.setdefault(st.st_size, []).append(p)
+
+  def _split(groups, hash_func):
+    """Split each group by `hash_func`, hashing on a thread pool"""
+    paths = [(p, size) for size, group in groups for p in group]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+      digests = list(executor.map(lambda args: hash_func(*args), paths))
+    buckets = {}
+    for (p, size), digest in zip(paths, digests):
+      buckets.setdefault((size, digest), []).append(p)
+    return [(size, group) for (size, _), group in buckets.items()
+            if len(group) > 1]
+
+  # (2) Hash head and tail blocks
+  groups = [(size, group) for size, group in by_size.items()
+            if len(group) > 1]
+  groups = _split(groups, lambda p, size: _hash_head_and_tail(
+    p, size, block_size, algorithm))
+
+  # (3) Fully hash files which are larger than the blocks hashed in (2)
+  small = [(size, group) for size, group in groups if size <= 2 * block_size]
+  large = [(size, group) for size, group in groups if size > 2 * block_size]
+  groups = small + _split(large, lambda p, _: _hash_file(p, algorithm))
+
+  groups.sort(key=lambda item: (-item[0], item[1]))
+  reclaimable = sum([size * (len(group) - 1) for size, group in groups])
+  groups = [sorted(group) for _, group in groups]
+
+  # Replace duplicates with hard links if required
+  if hardlink:
+    for group in groups:
+      for p in group[1:]:
+        tmp_path = None
+        try:
+          # `os.replace` does nothing if both paths are the same file
+          if os.path.samefile(group[0], p): continue
+          tmp_path = _link_to_temp(group[0], p)
+          os.replace(tmp_path, p)
+        except OSError:
+          # E.g., files are on different devices. Only links created here
+          #   are removed
+          if tmp_path is not None and os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+
+  if verbose: console.show_status(
+    '{} groups of duplicate files found, {} reclaimable{}'.format(
+      len(groups), atticus.readable_size(reclaimable),
+      ' (hard linked)' if hardlink else ''))
+  return groups, reclaimable
+
+
+class DiskUsage(object):
+  """Result of `disk_usage`. Each row is a tuple of (path, size, files), in
+  which `size` and `files` include all sub-directories.
+
+  Example:
+
+      du = disk_usage(root, max_depth=1)
+      du.sort(by='size').print_table(max_rows=20)
+  """
+
+  COLUMNS = ('path', 'size', 'files')
+
+  def __init__(self, root_path, rows):
+    self.root_path = root_path
+    self.rows = rows
+
+  @property
+  def total_size(self):
+    return self.rows[0][1] if self.rows else 0
+
+  def __iter__(self): return iter(self.rows)
+
+  def __len__(self): return len(self.rows)
+
+  def sort(self, by='size', reverse=None):
+    """Sort rows by `path`, `size` or `files`. By default, paths are sorted in
+    ascending order while the others are sorted in descending order."""
+    if by not in self.COLUMNS: raise ValueError(
+      '!! `by` should be one of {}'.format(self.COLUMNS))
+    if reverse is None: reverse = by != 'path'
+    index = self.COLUMNS.index(by)
+    self.rows.sort(key=lambda row: row[index], reverse=reverse)
+    return self
+
+  def table(self, max_rows=None, buffered=False) -> Table:
+    """Render rows into a `Table`"""
+    rows = self.rows if max_rows is None else self.rows[:max_rows]
+    # Paths are shown relative to the root, and long paths are truncated from
+    #   the left so that the deepest parts remain visible
+    names = [self.root_path if path == self.root_path
+             else os.path.relpath(path, self.root_path).replace('\\', '/')
+             for path, _, _ in rows]
+    width = min(max([len(name) for name in names] + [4]), 80)
+    names = [name if len(name) <= width else '...' + name[3 - width:]
+             for name in names]
+    table = Table(width, 10, 8, buffered=buffered)
+    table.specify_format(None, None, '{:,}', align='lrr')
+    table.print_header('Path', 'Size', 'Files')
+    for name, (_, size, files) in zip(names, rows):
+      table.print_row(name, atticus.readable_size(size), files)
+    table.hline()
+    return table
+
+  def print_table(self, max_rows=None):
+    self.table(max_rows)
+
+
+def disk_usage(root_path, max_depth=None, workers=8, apparent_size=False,
+               path_filter=None, **kwargs) -> DiskUsage:
+  """Calculate the total size of each directory under `root_path`. Sizes
+  are collected by a `ParallelWalker` which lists sibling directories and
+  stats their files concurrently, and then are summed bottom-up. Files hard
+  linked more than once are counted only once.
+
+  :param root_path: directory to be measured
+  :param max_depth: directories deeper than this depth will be merged into
+                    their ancestors. 0 for reporting `root_path` only
+  :param workers: number of listing threads
+  :param apparent_size: whether to use file sizes instead of the space
+                        allocated on disk
+  :param path_filter: a `PathFilter` compiled in advance. If not provided,
+                      one will be compiled using `kwargs`, which may contain
+                      `pattern`, `ignored_patterns`, `re_pattern` and
+                      `ignore_hidden_directories`
+  :return: a `DiskUsage` sorted by path
+  """
+  if not os.path.isdir(root_path): raise FileNotFoundError(
+    '!! Directory `{}` does not exist.'.format(root_path))
+  if root_path[-1] == '/': root_path = root_path[:-1]
+  path_filter = PathFilter.get(path_filter, **kwargs)
+
+  # Symbolic links are not followed
+  walker = ParallelWalker(workers, stat=True)
+  entries = walker._iwalk(root_path, True, path_filter, type_filter='file',
+                          follow_symlinks=False)
+
+  totals = {root_path: [0, 0]}
+  inodes = set()
+  for p, e in entries:
+    st = e.stat(follow_symlinks=False)
+    if st.st_nlink > 1:
+      if (st.st_dev, st.st_ino) in inodes: continue
+      inodes.add((st.st_dev, st.st_ino))
+    size = st.st_size
+    if not apparent_size and hasattr(st, 'st_blocks'): size = st.st_blocks * 512
+
+    # Add to all ancestors within `max_depth`
+    parts = p[len(root_path) + 1:].split('/')[:-1]
+    if max_depth is not None: parts = parts[:max_depth]
+    dir_path = root_path
+    for part in [None] + parts:
+      if part is not None: dir_path = dir_path + '/' + part
+      total = totals.setdefault(dir_path, [0, 0])
+      total[0] += size
+      total[1] += 1
+
+  rows = [(p, size, files) for p, (size, files) in totals.items()]
+  return DiskUsage(root_path, rows).sort(by='path')
+
+
+class SyncReport(object):
+  """Summary of a delta synchronization"""
+
+  def __init__(self):
+    self.copied = []
+    self.deleted = []
+    self.unchanged = 0
+    self.bytes_copied = 0
+    self.elapsed = 0.
+
+  def __str__(self):
+    return ('{} files ({} bytes) copied, {} deleted, {} unchanged in '
+            '{:.2f} sec'.format(len(self.copied), self.bytes_copied,
+                                len(self.deleted), self.unchanged,
+                                self.elapsed))
+
+
+def _delta_synchronize(src_dir, dst_dir, path_filter, delete, checksum,
+                       workers, verbose) -> SyncReport:
+  """Copy new or changed files from `src_dir` to `dst_dir` according to their
+  manifests, and delete stale files in `dst_dir` if required"""
+  report = SyncReport()
+  tic = time.time()
+
+  src_manifest = build_manifest(src_dir, path_filter)
+  dst_manifest = build_manifest(dst_dir, path_filter)
+
+  def _changed(rel_path):
+    if rel_path not in dst_manifest: return True
+    src_size, src_mtime, _ = src_manifest[rel_path]
+    dst_size, dst_mtime, _ = dst_manifest[rel_path]
+    if src_size != dst_size: return True
+    # Content hash is calculated only when sizes are the same
+    if checksum: return _hash_file(os.path.join(src_dir, rel_path)) != (
+      _hash_file(os.path.join(dst_dir, rel_path)))
+    # `copy2` preserves mtime, but some file systems truncate it
+    return abs(src_mtime - dst_mtime) >= _MTIME_TOLERANCE_NS
+
+  # Copy new or changed files
+  for rel_path in src_manifest:
+    if _changed(rel_path): report.copied.append(rel_path)
+    else: report.unchanged += 1
+  report.bytes_copied = copy_files(
+    [(os.path.join(src_dir, p), os.path.join(dst_dir, p))
+     for p in report.copied], workers=workers, verbose=verbose)
+
+  # Delete stale files
+  if delete: report.deleted = _delete_files(
+    dst_dir, [p for p in dst_manifest if p not in src_manifest])
+
+  report.elapsed = time.time() - tic
+  if verbose: console.show_status('Synchronized `{}` with `{}`: {}'.format(
+    dst_dir, src_dir, report))
+  return report
+
+
+def _delete_files(root_path, rel_paths) -> list:
+  """Delete files under `root_path` along with the directories they leave
+  empty. Files which do not exist are skipped.
+
+  :return: relative paths of deleted files
+  """
+  deleted = []
+  for rel_path in rel_paths:
+    try: os.remove(os.path.join(root_path, rel_path))
+    except FileNotFoundError: continue
+    deleted.append(rel_path)
+    parent = os.path.dirname(rel_path)
+    while parent and not os.listdir(os.path.join(root_path, parent)):
+      os.rmdir(os.path.join(root_path, parent))
+      parent = os.path.dirname(parent)
+  return deleted
+
+
+def _continuous_synchronize(watcher, src_dir, dst_dir, delete, workers,
+                            verbose, report: SyncReport) -> SyncReport:
+  """Apply batches of events emitted by `watcher` to `dst_dir` until
+  interrupted by keyboard"""
+  tic = time.time() - report.elapsed
+  if verbose: console.show_status(
+    'Watching `{}` ({} backend), press Ctrl+C to stop ...'.format(
+      src_dir, watcher.backend))
+  try:
+    for batch in watcher:
+      changed = [p for kind, p in batch if kind != Watcher.DELETED]
+      deleted = [p for kind, p in batch if kind == Watcher.DELETED]
+      pairs = [(os.path.join(src_dir, p), os.path.join(dst_dir, p))
+               for p in changed]
+      # Files created and deleted in the same batch are skipped
+      report.bytes_copied += copy_files(pairs, workers=workers,
+                                        skip_missing=True)
+      report.copied.extend(changed)
+      if delete: report.deleted.extend(_delete_files(dst_dir, deleted))
+      if verbose: console.show_status('{} files copied, {} deleted'.format(
+        len(changed), len(deleted) if delete else 0))
+  except KeyboardInterrupt:
+    if verbose: console.show_status('Stopped watching `{}`'.format(src_dir))
+  report.elapsed = time.time() - tic
+  return report
+
+
+class _DirState(object):
+  """Snapshot of a directory kept by `Watcher`"""
+
+  __slots__ = ('mtime', 'files', 'dirs')
+
+  def __init__(self, mtime):
+    self.mtime = mtime
+    # {name: (size, mtime_ns)}
+    self.files = {}
+    self.dirs = set()
+
+
+class Watcher(object):
+  """Watch file changes under a directory and emit batches of
+  (event, relative_path) tuples, in which event is one of `created`,
+  `modified` and `deleted`. Only files are reported.
+
+  Two backends are supported:
+  (1) `inotify`, available on Linux. Only directories reported by the kernel
+      will be re-scanned, and waiting for events costs no CPU.
+  (2) `polling`, available everywhere. Each directory is stat-ed in every
+      poll but re-listed only when its mtime has changed.
+
+  Example:
+
+      with Watcher(root, pattern='*.py') as watcher:
+        for batch in watcher:
+          for event, path in batch: print(event, path)
+  """
+
+  CREATED = 'created'
+  MODIFIED = 'modified'
+  DELETED = 'deleted'
+
+  # Constants from <sys/inotify.h>
+  IN_MODIFY = 0x00000002
+  IN_ATTRIB = 0x00000004
+  IN_CLOSE_WRITE = 0x00000008
+  IN_MOVED_FROM = 0x00000040
+  IN_MOVED_TO = 0x00000080
+  IN_CREATE = 0x00000100
+  IN_DELETE = 0x00000200
+  IN_DELETE_SELF = 0x00000400
+  IN_MOVE_SELF = 0x00000800
+  IN_Q_OVERFLOW = 0x00004000
+  IN_ONLYDIR = 0x01000000
+  IN_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+             IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+             IN_MOVE_SELF | IN_ONLYDIR)
+  _EVENT_HEADER = struct.Struct('iIII')
+
+  def __init__(self, root_path, pattern=None, ignored_patterns=(),
+               re_pattern=None, ignore_hidden_directories=True,
+               path_filter=None, interval=1.0, latency=0.05, backend=None):
+    """
+    :param root_path: directory to be watched
+    :param pattern: patterns to be included using fnmatch
+    :param ignored_patterns: patterns to be ignored using fnmatch
+    :param re_pattern: patterns to be included using regular expression
+    :param ignore_hidden_directories: whether to ignore hidden directories
+    :param path_filter: a `PathFilter` compiled in advance. If provided,
+                        `pattern`, `ignored_patterns`, `re_pattern` and
+                        `ignore_hidden_directories` will be ignored
+    :param interval: polling interval in seconds, used by `polling` backend
+    :param latency: time to wait for more events once an event arrives so
+                    that bursts of changes are emitted in one batch
+    :param backend: `inotify` or `polling`. By default, `inotify` will be
+                    used if available
+    """
+    if not os.path.isdir(root_path): raise FileNotFoundError(
+      '!! Directory `{}` does not exist.'.format(root_path))
+    if backend not in (None, 'inotify', 'polling'): raise ValueError(
+      '!! `backend` should be one of (`inotify`, `polling`)')
+    if root_path[-1] == '/': root_path = root_path[:-1]
+
+    self.root_path = root_path
+    self.path_filter = PathFilter.get(
+      path_filter, pattern, ignored_patterns, re_pattern,
+      ignore_hidden_directories=ignore_hidden_directories)
+    self.interval = interval
+    self.latency = latency
+
+    self._dirs = {}
+    self._libc = None
+    self._fd = None
+    self._wd_to_path = {}
+    self._path_to_wd = {}
+    self._last_poll = time.time()
+
+    if backend in (None, 'inotify'):
+      try: self._init_inotify()
+      except OSError:
+        if backend == 'inotify': raise
+        self._close_inotify()
+
+    # Take the initial snapshot
+    self._scan_dirs([root_path], [])
+
+  # region: Properties
+
+  @property
+  def backend(self):
+    return 'polling' if self._fd is None else 'inotify'
+
+  # endregion: Properties
+
+  # region: Private Methods
+
+  def _init_inotify(self):
+    if not sys.platform.startswith('linux'):
+      raise OSError('!! inotify is available only on Linux')
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                       use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+      raise OSError('!! inotify is not supported by libc')
+    self._libc = libc
+    self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self._fd < 0:
+      self._fd = None
+      raise OSError(ctypes.get_errno(), '!! Failed to initialize inotify')
+
+  def _close_inotify(self):
+    if self._fd is not None: os.close(self._fd)
+    self._fd = None
+    self._wd_to_path, self._path_to_wd = {}, {}
+
+  def _add_watch(self, dir_path):
+    if self._fd is None or dir_path in self._path_to_wd: return
+    wd = self._libc.inotify_add_watch(
+      self._fd, os.fsencode(dir_path), ctypes.c_uint32(self.IN_MASK))
+    if wd < 0:
+      err = ctypes.get_errno()
+      if err in (errno.ENOENT, errno.ENOTDIR): return
+      # E.g., ENOSPC when running out of watches, fall back to polling
+      self._close_inotify()
+      return
+    self._wd_to_path[wd] = dir_path
+    self._path_to_wd[dir_path] = wd
+
+  def _rm_watch(self, dir_path):
+    wd = self._path_to_wd.pop(dir_path, None)
+    if wd is None: return
+    self._wd_to_path.pop(wd, None)
+    self._libc.inotify_rm_watch(self._fd, wd)
+
+  def _rel_path(self, path):
+    return path[len(self.root_path) + 1:]
+
+  def _forget(self, dir_path, events):
+    """Forget a removed directory along with all its sub-directories"""
+    state = self._dirs.pop(dir_path, None)
+    if state is None: return
+    self._rm_watch(dir_path)
+    for name in state.files:
+      events.append((self.DELETED, self._rel_path(dir_path + '/' + name)))
+    for name in state.dirs: self._forget(dir_path + '/' + name, events)
+
+  def _scan(self, dir_path, events, force_list=False) -> bool:
+    """Scan a directory and compare it with the snapshot. Directory listing
+    is reused if its mtime has not changed.
+
+    :return: whether the directory still exists
+    """
+    try: mtime = os.stat(dir_path).st_mtime_ns
+    except (FileNotFoundError, NotADirectoryError):
+      self._forget(dir_path, events)
+      return False
+
+    old_state = self._dirs.get(dir_path)
+    state = _DirState(mtime)
+    if old_state is None or force_list or old_state.mtime != mtime:
+      self._add_watch(dir_path)
+      try: items = _list_dir(dir_path)
+      except (FileNotFoundError, NotADirectoryError):
+        self._forget(dir_path, events)
+        return False
+      for _, e in items:
+        if e.is_dir():
+          if self.path_filter.traversable(e.name): state.dirs.add(e.name)
+        elif e.is_file() and self.path_filter.includes(e.name):
+          state.files[e.name] = None
+      # Forget removed sub-directories
+      if old_state is not None:
+        for name in old_state.dirs - state.dirs:
+          self._forget(dir_path + '/' + name, events)
+    else:
+      state.dirs = old_state.dirs
+      state.files = dict.fromkeys(old_state.files)
+
+    # Check files
+    old_files = {} if old_state is None else old_state.files
+    for name in list(state.files.keys()):
+      try: st = os.stat(dir_path + '/' + name)
+      except FileNotFoundError:
+        state.files.pop(name)
+        continue
+      state.files[name] = (st.st_size, st.st_mtime_ns)
+      if name not in old_files:
+        events.append((self.CREATED, self._rel_path(dir_path + '/' + name)))
+      elif old_files[name] != state.files[name]:
+        events.append((self.MODIFIED, self._rel_path(dir_path + '/' + name)))
+    for name in old_files:
+      if name not in state.files:
+        events.append((self.DELETED, self._rel_path(dir_path + '/' + name)))
+
+    self._dirs[dir_path] = state
+    return True
+
+  def _scan_dirs(self, dir_paths, events, recursive=True):
+    """Scan given directories. New sub-directories will always be scanned.
+    Existing sub-directories will be scanned only if `recursive` is True."""
+    stack = list(dir_paths)
+    while stack:
+      dir_path = stack.pop()
+      old_dirs = self._dirs[dir_path].dirs if dir_path in self._dirs else None
+      if not self._scan(dir_path, events): continue
+      for name in self._dirs[dir_path].dirs:
+        if recursive or old_dirs is None or name not in old_dirs:
+          stack.append(dir_path + '/' + name)
+
+  def _read_inotify(self) -> set:
+    """Read all pending inotify events and return paths of dirty directories.
+    If the event queue overflows, all directories are regarded as dirty."""
+    dirty = set()
+    while True:
+      try: buffer = os.read(self._fd, 64 * 1024)
+      except BlockingIOError: break
+      offset = 0
+      while offset < len(buffer):
+        wd, mask, _, length = self._EVENT_HEADER.unpack_from(buffer, offset)
+        offset += self._EVENT_HEADER.size + length
+        if mask & self.IN_Q_OVERFLOW: dirty.update(self._dirs.keys())
+        elif wd in self._wd_to_path: dirty.add(self._wd_to_path[wd])
+    return dirty
+
+  def _poll_inotify(self, timeout):
+    readable, _, _ = select.select([self._fd], [], [], timeout)
+    if not readable: return set()
+    # Wait for a while to gather a burst of events into one batch
+    if self.latency > 0: time.sleep(self.latency)
+    return self._read_inotify()
+
+  # endregion: Private Methods
+
+  # region: Public Methods
+
+  def poll(self, timeout=None) -> list:
+    """Wait for changes and return a batch of events, which may be empty if
+    nothing has changed before `timeout`.
+
+    :param timeout: maximum time to wait in seconds. None means waiting
+                    until something changes
+    :return: a list of (event, relative_path) tuples
+    """
+    events = []
+    deadline = None if timeout is None else time.time() + timeout
+    while len(events) == 0:
+      remain = None if deadline is None else max(deadline - time.time(), 0)
+      if self._fd is not None:
+        # Directories are scanned without recursion, new ones are scanned
+        # automatically
+        dirty = self._poll_inotify(remain)
+        self._scan_dirs(sorted(dirty, reverse=True), events, recursive=False)
+      else:
+        wait = self._last_poll + self.interval - time.time()
+        if remain is not None: wait = min(wait, remain)
+        if wait > 0: time.sleep(wait)
+        if self._last_poll + self.interval <= time.time():
+          self._last_poll = time.time()
+          self._scan_dirs([self.root_path], events)
+      if deadline is not None and time.time() >= deadline: break
+    return events
+
+  def __iter__(self):
+    while True: yield self.poll()
+
+  def close(self):
+    self._close_inotify()
+
+  def __enter__(self): return self
+
+  def __exit__(self, *args): self.close()
+
+  # endregion: Public Methods
+
+
+def watch(root_path, pattern=None, ignored_patterns=(), re_pattern=None,
+          ignore_hidden_directories=True, path_filter=None, interval=1.0,
+          backend=None):
+  """Watch file changes under `root_path` and yield batches of
+  (event, relative_path) tuples forever. See `Watcher` for details.
+
+  Example:
+
+      for batch in watch(root, pattern='*.py'):
+        print(batch)
+  """
+  with Watcher(root_path, pattern, ignored_patterns, re_pattern,
+               ignore_hidden_directories=ignore_hidden_directories,
+               path_filter=path_filter, interval=interval,
+               backend=backend) as watcher:
+    yield from watcher
 
 
 def synchronize(src_dir, dst_dir, pattern=None, ignored_patterns=(),
-                re_pattern=None, ignore_hidden_directories=True, verbose=False):
+                re_pattern=None, ignore_hidden_directories=True, verbose=False,
+                path_filter=None, mode='zip', delete=False, checksum=False,
+                workers=4, continuous=False, interval=1.0):
   """Synchronize `dst_dir` with `src_dir`. This method was designed under the
   need of synchronizing the project directory on a GPU server with the local
   project directory which is hierarchical.
@@ -237,7 +1831,30 @@ def synchronize(src_dir, dst_dir, pattern=None, ignored_patterns=(),
   :param re_pattern: patterns to be included using regular expression
   :param ignore_hidden_directories: whether to ignore hidden directories
   :param verbose: whether or not to print processing details
+  :param path_filter: a `PathFilter` compiled in advance. If provided,
+                      `pattern`, `ignored_patterns`, `re_pattern` and
+                      `ignore_hidden_directories` will be ignored
+  :param mode: (1) `zip` (default), zip the whole source directory and unzip
+                   it to the destination
+               (2) `delta`, copy only new or changed files according to the
+                   manifests of both sides using `copy_files`, without
+                   any intermediate ZIP file
+  :param delete: whether to delete files in `dst_dir` which do not exist in
+                 `src_dir`. Works only in `delta` mode
+  :param checksum: whether to compare content hash instead of mtime for
+                   files with the same size. Works only in `delta` mode
+  :param workers: maximum number of files being copied at the same time.
+                  Works only in `delta` mode
+  :param continuous: whether to keep synchronizing after the first pass by
+                     consuming events from a `Watcher` on `src_dir` instead
+                     of rescanning, until interrupted by Ctrl+C. Works only
+                     in `delta` mode
+  :param interval: polling interval used when inotify is not available
+  :return: a `SyncReport` in `delta` mode
   """
+  if mode not in ('zip', 'delta'): raise ValueError(
+    '!! `mode` should be one of (`zip`, `delta`)')
+
   # Sanity check
   for path, name in zip((src_dir, dst_dir), ('Source', 'Destination')):
     if not os.path.exists(path): raise FileNotFoundError(
@@ -248,13 +1865,24 @@ def synchronize(src_dir, dst_dir, pattern=None, ignored_patterns=(),
                          ' path `{}` should be the same.'.format(
       src_dir, dst_dir))
 
+  if mode == 'delta':
+    path_filter = PathFilter.get(
+      path_filter, pattern, ignored_patterns, re_pattern,
+      ignore_hidden_directories=ignore_hidden_directories)
+    if not continuous: return _delta_synchronize(
+      src_dir, dst_dir, path_filter, delete, checksum, workers, verbose)
+
+    # Start watching before the first pass so that no change will be missed
+    with Watcher(src_dir, path_filter=path_filter,
+                 interval=interval) as watcher:
+      report = _delta_synchronize(
+        src_dir, dst_dir, path_filter, delete, checksum, workers, verbose)
+      return _continuous_synchronize(
+        watcher, src_dir, dst_dir, delete, workers, verbose, report)
+
   # Create a .zip file from source path
   zip_path = zip_dir(src_dir, pattern, ignored_patterns, re_pattern,
                      ignore_hidden_directories=ignore_hidden_directories,
-                     verbose=verbose)
+                     verbose=verbose, path_filter=path_filter)
   # Unzip
   unzip_file(zip_path, os.path.dirname(dst_dir), verbose=verbose)
-
-
-
-
@@ -50,14 +50,174 @@ Result:
        Macro Avg          0.547    0.511    0.465        25
        Weighted Avg       0.581    0.480    0.464        25
       ------------------------------------------------------
+
+To stream a large table into a file with bounded memory:
+
+    with Table(12, 9, sink='metrics.txt') as table:
+      table.print_header('Epoch', 'Loss')
+      table.print_rows(rows)
+
+To render NumPy arrays, structured arrays or dicts of columns directly:
+
+    table = Table.from_array(metrics, '{:d}', '{:.4f}', '{:.2%}')
+    table.print_array(metrics)
+
+To write header and rows to other formats while printing:
+
+    table.export('metrics.csv')
+    table.export('metrics.md')
+    table.export('metrics.jsonl')
+
+To watch metrics updated in place, at most 10 times per second:
+
+    with LiveTable(12, 9, refresh_rate=10) as table:
+      table.print_header('Task', 'Loss')
+      for step in range(steps):
+        table.update(task, task, loss)
 """
+from itertools import islice
+
+import csv
+import json
+import re
+import sys
+import threading
+import time
+
+
+def _array_columns(data):
+  """Split a 2-D array, structured array or dict of columns into columns.
+
+  :return: a tuple of (names, columns), in which names may be None
+  """
+  import numpy as np
+
+  if isinstance(data, dict):
+    names = [str(k) for k in data.keys()]
+    columns = [np.asarray(v) for v in data.values()]
+  else:
+    data = np.asarray(data)
+    if data.dtype.names is not None:
+      names = list(data.dtype.names)
+      columns = [data[name] for name in names]
+    else:
+      if data.ndim != 2: raise ValueError(
+        '!! Array should be 2-D, but got {}-D.'.format(data.ndim))
+      names = None
+      columns = list(data.T)
+  assert all([c.ndim == 1 and len(c) == len(columns[0]) for c in columns])
+  return names, columns
+
+
+def _format_column(column, fmt: str) -> list:
+  """Format a whole column at once. The column is converted to Python scalars
+  in one call and formatted by `map` without per-cell Python code. Strings
+  are not formatted, the same as `Table.print_row` does."""
+  kind = column.dtype.kind
+  if kind in 'US': return column.astype(str).tolist()
+  if kind == 'O': return [c if isinstance(c, str) else fmt.format(c)
+                          for c in column.tolist()]
+  if fmt == '{}': return list(map(str, column.tolist()))
+  return list(map(fmt.format, column.tolist()))
+
+
+class Exporter(object):
+  """Base class of exporters which write rows of a `Table` to a text stream
+  or a file row by row. Cells are formatted by the column formats specified
+  in the table, without truncation or padding."""
+
+  def __init__(self, target, table):
+    self._own_stream = isinstance(target, str)
+    self._stream = open(target, 'w', newline='') if self._own_stream else (
+      target)
+    self._table = table
+    self._header = None
+
+  def write_header(self, cells):
+    self._header = list(cells)
+
+  def write_rows(self, rows):
+    raise NotImplementedError
+
+  def close(self):
+    if self._stream is None: return
+    if self._own_stream: self._stream.close()
+    elif hasattr(self._stream, 'flush'): self._stream.flush()
+    self._stream = None
+
+
+class CSVExporter(Exporter):
+
+  def __init__(self, target, table):
+    super().__init__(target, table)
+    self._writer = csv.writer(self._stream)
+
+  def write_header(self, cells):
+    super().write_header(cells)
+    self._writer.writerow(self._header)
+
+  def write_rows(self, rows): self._writer.writerows(rows)
+
+
+class MarkdownExporter(Exporter):
+
+  @staticmethod
+  def _line(cells):
+    return '| {} |\n'.format(' | '.join([c.replace('|', '\\|') for c in cells]))
+
+  def write_header(self, cells):
+    super().write_header(cells)
+    self._stream.write(self._line(self._header) + '|{}|\n'.format('|'.join(
+      ['---:' if a == 'r' else ':---' for a in self._table.align])))
+
+  def write_rows(self, rows):
+    # Markdown tables can not go without a header row
+    if self._header is None: self.write_header([''] * self._table.columns)
+    self._stream.writelines(map(self._line, rows))
+
+
+class JSONLExporter(Exporter):
+  """Each row is written as an object keyed by header if provided, otherwise
+  as an array. Formatted cells which are JSON numbers are written as numbers.
+  """
+
+  _NUMBER = re.compile(r'-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?')
+
+  def _value(self, cell):
+    return json.loads(cell) if self._NUMBER.fullmatch(cell) else cell
+
+  def write_rows(self, rows):
+    for row in rows:
+      values = [self._value(c) for c in row]
+      obj = values if self._header is None else dict(zip(self._header, values))
+      self._stream.write(json.dumps(obj) + '\n')
+
+
+EXPORTERS = {'csv': CSVExporter, 'md': MarkdownExporter,
+             'markdown': MarkdownExporter, 'jsonl': JSONLExporter}
 
 
 
 class Table(object):
 
-  def __init__(self, *widths, tab=4, margin=2, buffered=False, indent=0):
+  # Maximum number of rows formatted at once by `print_rows`
+  ROWS_PER_WRITE = 4096
+
+  def __init__(self, *widths, tab=4, margin=2, buffered=False, indent=0,
+               sink=None, flush_size=1 << 16, flush_interval=1.0):
+    """
+    :param widths: width of each column
+    :param tab: number of spaces between columns
+    :param margin: number of spaces on both sides
+    :param buffered: whether to keep all lines in memory instead of printing
+    :param indent: number of spaces before each line
+    :param sink: a text stream or a file path. If provided, lines will be
+                 written to it through a small buffer, which is flushed once
+                 it holds `flush_size` characters or `flush_interval`
+                 seconds have passed since the last flush
+    """
     assert len(widths) > 0
+    assert not (buffered and sink is not None)
     self.columns = len(widths)
     self._widths = widths
     self._margin = margin
@@ -67,10 +227,27 @@ class Table(object):
     self._buffered = buffered
     self._buffer = []
     self._indent = indent
+    self._compile()
+
+    # Sink mode
+    self._own_sink = isinstance(sink, str)
+    self._sink = open(sink, 'w') if self._own_sink else sink
+    self._flush_size = flush_size
+    self._flush_interval = flush_interval
+    self._pending = []
+    self._pending_size = 0
+    self._last_flush = time.time()
+
+    self._exporters = []
 
   @property
   def content(self): return '\n'.join(self._buffer)
 
+  @property
+  def align(self):
+    if self._align is None: return 'l' + 'r' * (self.columns - 1)
+    return self._align
+
   @property
   def tab(self): return ' ' * self._tab
 
@@ -81,9 +258,60 @@ class Table(object):
   def __str__(self): return self.content
 
   def print(self, string):
-    indentation = ' ' * self._indent
-    if self._buffered: self._buffer.append(indentation + string)
-    else: print(indentation + string)
+    self._write_lines([' ' * self._indent + string])
+
+  def _write_lines(self, lines):
+    if self._sink is not None:
+      self._pending.extend(lines)
+      self._pending_size += sum([len(l) + 1 for l in lines])
+      if (self._pending_size >= self._flush_size or
+          time.time() - self._last_flush >= self._flush_interval):
+        self.flush()
+    elif self._buffered: self._buffer.extend(lines)
+    else: print('\n'.join(lines))
+
+  def flush(self):
+    """Write pending lines to sink"""
+    if self._sink is None: return
+    if self._pending:
+      self._sink.write('\n'.join(self._pending) + '\n')
+      if hasattr(self._sink, 'flush'): self._sink.flush()
+    self._pending = []
+    self._pending_size = 0
+    self._last_flush = time.time()
+
+  def close(self):
+    """Flush pending lines, close the sink if it was opened by table, and
+    close all exporters"""
+    for exporter in self._exporters: exporter.close()
+    self._exporters = []
+    if self._sink is None: return
+    self.flush()
+    if self._own_sink: self._sink.close()
+    self._sink = None
+
+  def export(self, target, fmt=None) -> Exporter:
+    """Write header and rows printed afterwards to `target` as well. Lines
+    such as `hline` are not exported.
+
+    :param target: a text stream or a file path
+    :param fmt: 'csv', 'md' (or 'markdown') or 'jsonl'. If not provided, it
+                will be inferred from the extension of `target`
+    :return: the exporter, which will be closed by `Table.close`
+    """
+    if fmt is None:
+      if not isinstance(target, str): raise ValueError(
+        '!! `fmt` must be specified when exporting to a stream')
+      fmt = target.rsplit('.', 1)[-1].lower()
+    if fmt not in EXPORTERS: raise ValueError(
+      '!! `fmt` should be one of {}'.format(tuple(EXPORTERS.keys())))
+    exporter = EXPORTERS[fmt](target, self)
+    self._exporters.append(exporter)
+    return exporter
+
+  def __enter__(self): return self
+
+  def __exit__(self, *args): self.close()
 
   def hline(self): self.print('-' * self.hline_width)
 
@@ -98,14 +326,30 @@ class Table(object):
     if align is not None:
       self._align = align
       assert len(align) == self.columns
+    self._compile()
+
+  def _compile(self):
+    """Precompile the row template for current widths, alignment and column
+    formats. Cells are truncated to column widths by the precision field."""
+    self._line_fmt = self.tab.join(
+      ['{{:{}{}.{}}}'.format('>' if a == 'r' else '<', w, w)
+       for w, a in zip(self._widths, self.align)])
+    self._row_fmt = '{0}{1}{0}'.format(' ' * self._margin, self._line_fmt)
+    self._cell_fmts = [fmt.format for fmt in self._col_fmt]
 
   def _get_line(self, cells):
-    if self._align is None: return self.tab.join(
-      [(('{:>' if i > 0 else '{:<') + str(w) + '}').format(c[:w])
-       for i, (c, w) in enumerate(zip(cells, self._widths))])
-    else: return self.tab.join(
-      [(('{:>' if a == 'r' else '{:<') + str(w) + '}').format(c[:w])
-       for c, w, a in zip(cells, self._widths, self._align)])
+    return self._line_fmt.format(*cells)
+
+  def _format_cells(self, cells):
+    assert len(cells) == self.columns
+    return [c if isinstance(c, str) else f(c)
+            for c, f in zip(cells, self._cell_fmts)]
+
+  def _format_row(self, cells):
+    return self._row_fmt.format(*self._format_cells(cells))
+
+  def _export(self, rows):
+    for exporter in self._exporters: exporter.write_rows(rows)
 
   def print_with_margin(self, content):
     margin = ' ' * self._margin
@@ -113,15 +357,173 @@ class Table(object):
 
   def print_header(self, *header, hline=True):
     if hline: self.hline()
-    self.print_row(*header)
+    cells = self._format_cells(header)
+    self.print(self._row_fmt.format(*cells))
+    for exporter in self._exporters: exporter.write_header(cells)
     if hline: self.dhline()
 
   def print_row(self, *cells):
-    assert len(cells) == self.columns
-    cells = [c if isinstance(c, str) else fmt.format(c)
-             for c, fmt in zip(cells, self._col_fmt)]
-    self.print_with_margin(self._get_line(cells))
+    cells = self._format_cells(cells)
+    self.print(self._row_fmt.format(*cells))
+    if self._exporters: self._export([cells])
+
+  def print_rows(self, rows):
+    """Print many rows at once. Rows are formatted in chunks of
+    `ROWS_PER_WRITE`, each of which is written in a single call."""
+    indentation = ' ' * self._indent
+    rows = iter(rows)
+    while True:
+      chunk = [self._format_cells(cells)
+               for cells in islice(rows, self.ROWS_PER_WRITE)]
+      if len(chunk) == 0: return
+      self._write_lines([indentation + self._row_fmt.format(*cells)
+                         for cells in chunk])
+      if self._exporters: self._export(chunk)
+
+  @classmethod
+  def from_array(cls, data, *fmts, align=None, header=None, sample_size=1000,
+                 max_width=40, **kwargs):
+    """Create a table for `data`, which can be a 2-D array, a structured
+    array or a dict of columns. Column widths are decided by the header and
+    the formatted cells of (at most) the first `sample_size` rows.
+
+    :param data: data to be rendered by `print_array`
+    :param fmts: format of each column, e.g., '{:.3f}'
+    :param align: alignment string, e.g., 'lrr'
+    :param header: column names. By default, field names or dict keys are used
+    :param sample_size: number of rows used to decide column widths
+    :param max_width: maximum width of each column
+    :param kwargs: other arguments for the constructor, e.g., `tab`
+    """
+    names, columns = _array_columns(data)
+    if header is None: header = names
+    if len(fmts) == 0: fmts = [None] * len(columns)
+    assert len(fmts) == len(columns)
+    fmts = ['{}' if f in (None, '') else f for f in fmts]
+
+    widths = []
+    for i, (column, fmt) in enumerate(zip(columns, fmts)):
+      cells = _format_column(column[:sample_size], fmt)
+      width = max([len(c) for c in cells] + [1])
+      if header is not None: width = max(width, len(str(header[i])))
+      widths.append(min(width, max_width))
+
+    table = cls(*widths, **kwargs)
+    table.specify_format(*fmts, align=align)
+    return table
+
+  def print_array(self, data, header=None, hline=True):
+    """Print a 2-D array, a structured array or a dict of columns. Each column
+    is formatted at once according to its dtype, then rows are written in
+    chunks of `ROWS_PER_WRITE`.
+
+    :param data: data to be printed
+    :param header: column names. By default, field names or dict keys are
+                   used. Set to False to hide header
+    :param hline: whether to print horizontal lines around the table
+    """
+    names, columns = _array_columns(data)
+    assert len(columns) == self.columns
+    if header is None: header = names
+    if header: self.print_header(*header, hline=hline)
+
+    indentation = ' ' * self._indent
+    for start in range(0, len(columns[0]), self.ROWS_PER_WRITE):
+      cells = [_format_column(column[start:start + self.ROWS_PER_WRITE], fmt)
+               for column, fmt in zip(columns, self._col_fmt)]
+      lines = map(self._row_fmt.format, *cells)
+      if indentation: lines = [indentation + l for l in lines]
+      self._write_lines(list(lines))
+      if self._exporters: self._export(list(zip(*cells)))
+    if hline: self.hline()
 
   def print_buffer(self, indent=0):
     for row in self._buffer: print('{}{}'.format(' ' * indent, row))
 
+
+class LiveTable(Table):
+  """A table whose rows are updated in place by key. Lines printed by methods
+  such as `print_header` stay above the rows. The table is redrawn by ANSI
+  cursor movement at most `refresh_rate` times per second, so that updates
+  arriving between two redraws are merged into one. Updates skipped this way
+  are drawn by a trailing redraw once the interval has passed."""
+
+  def __init__(self, *widths, refresh_rate=10, stream=None, **kwargs):
+    """
+    :param widths: width of each column
+    :param refresh_rate: maximum number of redraws per second
+    :param stream: a text stream to draw on, `sys.stdout` by default
+    :param kwargs: other arguments for the constructor, e.g., `tab`
+    """
+    assert refresh_rate > 0
+    assert not kwargs.get('buffered') and kwargs.get('sink') is None
+    super().__init__(*widths, **kwargs)
+    self._stream = sys.stdout if stream is None else stream
+    self._interval = 1.0 / refresh_rate
+    self._head = []
+    self._rows = {}
+    self._drawn = 0
+    self._dirty = False
+    self._last_draw = 0.0
+    self._lock = threading.RLock()
+    self._timer = None
+    self.redraws = 0
+
+  @property
+  def rows(self): return self._rows
+
+  def _write_lines(self, lines):
+    self._head.extend(lines)
+    self._dirty = True
+
+  def update(self, key, *cells):
+    """Set the row of `key` to `cells`. New keys are appended to the end."""
+    assert len(cells) == self.columns
+    with self._lock:
+      self._rows[key] = cells
+      self._dirty = True
+      remaining = self._last_draw + self._interval - time.time()
+      if remaining <= 0: self.redraw()
+      elif self._timer is None:
+        # Schedule a trailing redraw so that this update will not stay off
+        #   screen until the next one
+        self._timer = threading.Timer(remaining, self._redraw_later)
+        self._timer.daemon = True
+        self._timer.start()
+
+  def _redraw_later(self):
+    with self._lock:
+      self._timer = None
+      self.flush()
+
+  def redraw(self):
+    """Draw head lines and all rows over the previous drawing in one write"""
+    with self._lock: self._redraw()
+
+  def _redraw(self):
+    indentation = ' ' * self._indent
+    lines = self._head + [indentation + self._format_row(cells)
+                          for cells in self._rows.values()]
+    up = '\x1b[{}F'.format(self._drawn) if self._drawn else ''
+    self._stream.write(up + ''.join(
+      ['\x1b[2K{}\n'.format(l) for l in lines]) + '\x1b[J')
+    if hasattr(self._stream, 'flush'): self._stream.flush()
+    self._drawn = len(lines)
+    self._dirty = False
+    self._last_draw = time.time()
+    self.redraws += 1
+
+  def flush(self):
+    """Redraw if there are updates not drawn yet"""
+    with self._lock:
+      if self._dirty: self._redraw()
+
+  def close(self):
+    """Draw the final state and export the final rows"""
+    with self._lock:
+      if self._timer is not None: self._timer.cancel()
+      self._timer = None
+      self.flush()
+    if self._exporters: self._export(
+      [self._format_cells(cells) for cells in self._rows.values()])
+    super().close()
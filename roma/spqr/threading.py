@@ -14,10 +14,201 @@
 # =-==========================================================================-
 import time
 
+from bisect import bisect_left
+from concurrent.futures import Future, wait
 from roma import Nomear
-from typing import Callable
+from roma.spqr.table import Table
+from typing import Awaitable, Callable, Iterable, Iterator, Optional, Union
 
+import asyncio
+import inspect
+import json
+import multiprocessing
+import os
+import queue
+import sys
 import threading
+import traceback
+
+
+
+class NodeStats(object):
+  """Runtime statistics of an instrumented XNode. Latencies are counted in a
+  histogram with buckets doubling from 1 microsecond."""
+
+  BUCKETS = tuple(1e-6 * 2 ** i for i in range(25))
+
+  def __init__(self):
+    self.iterations = 0
+    self.exceptions = 0
+    self.last_exception = None
+    self.total_time = 0.0
+    self.max_latency = 0.0
+    self.thread_time = 0.0
+    self.histogram = [0] * (len(self.BUCKETS) + 1)
+    self.queues = {}
+
+  @property
+  def mean_latency(self):
+    return self.total_time / self.iterations if self.iterations else 0.0
+
+  def percentile(self, q: float) -> float:
+    """Get the upper bound of the bucket containing the q-th percentile"""
+    target, count = self.iterations * q / 100, 0
+    for bound, n in zip(self.BUCKETS, self.histogram):
+      count += n
+      if count >= target and count > 0: return min(bound, self.max_latency)
+    return self.max_latency
+
+  def _record(self, latency):
+    self.iterations += 1
+    self.total_time += latency
+    if latency > self.max_latency: self.max_latency = latency
+    self.histogram[bisect_left(self.BUCKETS, latency)] += 1
+
+  def measure(self, func: Callable, *args):
+    """Call `func` and record its latency, CPU time and exceptions"""
+    start, cpu = time.perf_counter(), time.thread_time()
+    try: return func(*args)
+    except BaseException as e:
+      self.exceptions += 1
+      self.last_exception = repr(e)
+      raise
+    finally:
+      self.thread_time += time.thread_time() - cpu
+      self._record(time.perf_counter() - start)
+
+  async def measure_async(self, func: Callable):
+    """Await `func` and record its latency and exceptions. CPU time is not
+    recorded since other tasks share the same thread"""
+    start = time.perf_counter()
+    try:
+      result = func()
+      return await result if inspect.isawaitable(result) else result
+    except BaseException as e:
+      self.exceptions += 1
+      self.last_exception = repr(e)
+      raise
+    finally: self._record(time.perf_counter() - start)
+
+  def to_dict(self) -> dict:
+    return {
+      'iterations': self.iterations, 'exceptions': self.exceptions,
+      'last_exception': self.last_exception, 'total_time': self.total_time,
+      'mean_latency': self.mean_latency, 'p50': self.percentile(50),
+      'p99': self.percentile(99), 'max_latency': self.max_latency,
+      'thread_time': self.thread_time,
+      'histogram': [[b, n] for b, n in zip(self.BUCKETS + (None,),
+                                           self.histogram) if n],
+      'queues': {k: q.qsize() for k, q in self.queues.items()}}
+
+
+class _Untracked(object):
+  """Stands for nodes which can not be instrumented in loops"""
+  stats = None
+
+
+def _while_loop(func: Callable, stop, node=_Untracked):
+  def while_loop():
+    while not stop.is_set():
+      if node.stats is None: func()
+      else: node.stats.measure(func)
+  return while_loop
+
+
+def _event_loop(func: Callable, stop, wake, interval=None, max_rate=None,
+                on_signal=False, node=_Untracked):
+  periods = [p for p in (interval, max_rate and 1.0 / max_rate) if p]
+  period = max(periods) if periods else None
+
+  def event_loop():
+    next_time = time.monotonic()
+    while not stop.is_set():
+      if on_signal:
+        wake.wait()
+        if stop.is_set(): return
+        wake.clear()
+      if node.stats is None: func()
+      else: node.stats.measure(func)
+      if period is None: continue
+      # Sleep until the next tick, skipping ticks missed by slow calls
+      next_time += period
+      now = time.monotonic()
+      if next_time > now: stop.wait(next_time - now)
+      else: next_time = now
+
+  return event_loop
+
+
+
+class WorkerPool(object):
+  """A bounded pool of threads shared by XNodes. Threads are created on demand
+  until `max_workers` is reached and are reused afterwards. Long-live tasks
+  submitted by XNodes run one iteration at a time, so that they take turns
+  with other tasks instead of occupying a thread forever."""
+
+  _default = None
+  _default_lock = threading.Lock()
+
+  def __init__(self, max_workers: Optional[int] = None, daemon: bool = True,
+               name: str = 'WorkerPool'):
+    """
+    :param max_workers: maximum number of threads, min(32, cpu_count + 4) by
+                        default
+    :param daemon: whether threads in this pool are daemon threads
+    :param name: prefix of thread names
+    """
+    if max_workers is None: max_workers = min(32, (os.cpu_count() or 1) + 4)
+    assert max_workers > 0
+    self.max_workers = max_workers
+    self.daemon = daemon
+    self.name = name
+    self._tasks = queue.SimpleQueue()
+    self._threads = []
+    self._idle = threading.Semaphore(0)
+    self._lock = threading.Lock()
+    self._shutdown = False
+
+  @classmethod
+  def default(cls):
+    """Get the pool shared by all XNodes using `pool=True`"""
+    with cls._default_lock:
+      if cls._default is None: cls._default = WorkerPool()
+      return cls._default
+
+  @property
+  def size(self): return len(self._threads)
+
+  def submit(self, func: Callable):
+    if self._shutdown: raise RuntimeError(
+      '!! Can not submit tasks to a pool which has been shut down')
+    self._tasks.put(func)
+    # Create a new thread only if no thread is idle
+    if self._idle.acquire(timeout=0): return
+    with self._lock:
+      if len(self._threads) >= self.max_workers: return
+      t = threading.Thread(target=self._work, daemon=self.daemon,
+                           name='{}-{}'.format(self.name, len(self._threads)))
+      self._threads.append(t)
+    t.start()
+
+  def _work(self):
+    while True:
+      func = self._tasks.get()
+      if func is None: return
+      try: func()
+      except Exception: traceback.print_exc()
+      self._idle.release()
+
+  def shutdown(self, wait: bool = True):
+    """Stop all threads after queued tasks are done. Long-live tasks should be
+    terminated before shutting down."""
+    with self._lock:
+      self._shutdown = True
+      threads = list(self._threads)
+    for _ in threads: self._tasks.put(None)
+    if wait:
+      for t in threads: t.join()
 
 
 
@@ -25,6 +216,13 @@ class XNode(Nomear):
 
   KEY_SHOULD_TERMINATE = 'KEY_SHOULD_TERMINATE'
   KEY_PARENT_THREAD = 'KEY_PARENT_THREAD'
+  KEY_DONE_EVENT = 'KEY_DONE_EVENT'
+  KEY_STEP_THREAD = 'KEY_STEP_THREAD'
+
+  # Name shown in snapshots
+  name = None
+  # Set to a `NodeStats` by `instrument`
+  stats = None
 
   @property
   def parent_node(self):
@@ -43,47 +241,692 @@ class XNode(Nomear):
 
   @property
   def should_terminate(self):
+    if self.termination_event.is_set(): return True
     # Otherwise, check the corresponding flag in pocket
     return self.get_from_pocket(self.KEY_SHOULD_TERMINATE, False)
 
 
+  @Nomear.property()
+  def termination_event(self):
+    """Set by `terminate`. Loops of long-live nodes wait on this event so that
+    they can be woken up immediately once terminated"""
+    return threading.Event()
+
+
+  @Nomear.property()
+  def wake_event(self): return threading.Event()
+
+
   @Nomear.property(key='this_thread')
   def thread(self):
     return threading.currentThread()
 
 
+  def wake(self):
+    """Wake up this node if it is executed with `on_signal=True`. Signals
+    arriving before the node wakes up are merged into one."""
+    self.wake_event.set()
+
+
   def terminate(self, block=False):
     """Terminate this thread, which should be executed as long-live thread.
+    All children of this node will be terminated as well.
     """
+    nodes = self._terminate_tree()
+    parent = self.get_from_pocket(self.KEY_PARENT_THREAD)
+    if parent is not None and self in parent.child_nodes:
+      parent.child_nodes.remove(self)
+    if block:
+      for node in nodes: node._join()
+
+
+  def _terminate_tree(self) -> list:
+    """Set termination flags of this node and its descendants, and return
+    all of them"""
+    nodes = [self]
+    for node in self.child_nodes: nodes.extend(node._terminate_tree())
+    self.child_nodes.clear()
     self.put_into_pocket(self.KEY_SHOULD_TERMINATE, True, exclusive=False)
-    assert isinstance(self.parent_node, XNode)
-    self.parent_node.child_nodes.remove(self)
-    if block: self.thread.join()
+    self.termination_event.set()
+    self.wake_event.set()
+    return nodes
+
+
+  def _join(self):
+    # Nodes executed in a pool have no thread of their own
+    done = self.get_from_pocket(self.KEY_DONE_EVENT)
+    if done is not None:
+      # Nodes terminated from their own step can not wait for themselves
+      step_thread = self.get_from_pocket(self.KEY_STEP_THREAD)
+      if step_thread is threading.current_thread(): return
+      return done.wait()
+    # Nodes which have never been executed have nothing to join
+    thread = self.get_from_pocket('this_thread')
+    if thread is not None and thread is not threading.current_thread():
+      thread.join()
 
 
   def execute_a_new_child(self, func: Callable, long_live: bool = True,
-                          daemon: bool = True):
+                          daemon: bool = True,
+                          pool: Union[WorkerPool, bool, None] = None,
+                          interval: Optional[float] = None,
+                          max_rate: Optional[float] = None,
+                          on_signal: bool = False, name: Optional[str] = None):
     """Life cycle of children executed using this method will follow &self
     """
-    node = XNode()
+    node = self.__class__()
+    node.name = name
     self.child_nodes.append(node)
     node.parent_node = self
-    node.execute_async(func, long_live, daemon=daemon)
+    # Children of instrumented nodes are instrumented as well
+    if self.stats is not None: node.instrument()
+    node.execute_async(func, long_live, daemon=daemon, pool=pool,
+                       interval=interval, max_rate=max_rate,
+                       on_signal=on_signal)
     return node
 
 
   def execute_async(self, func: Callable, long_live: bool = True,
-                    daemon: bool = True):
-    if long_live: func = self._get_while_loop(func)
+                    daemon: bool = True,
+                    pool: Union[WorkerPool, bool, None] = None,
+                    interval: Optional[float] = None,
+                    max_rate: Optional[float] = None,
+                    on_signal: bool = False):
+    """Execute `func` in a new thread, or in `pool` if provided. If `pool` is
+    True, the default shared pool will be used. `daemon` is ignored in the
+    latter case.
+
+    Long-live nodes can be scheduled by the following arguments, in which
+    case the node sleeps on events between iterations and can be terminated
+    at any time:
+
+    :param interval: call `func` every `interval` seconds
+    :param max_rate: call `func` at most `max_rate` times per second
+    :param on_signal: call `func` only after `wake` is called
+    """
+    scheduled = interval is not None or max_rate is not None or on_signal
+    if pool:
+      if scheduled: raise ValueError(
+        '!! Scheduling is not supported for nodes executed in a pool')
+      if pool is True: pool = WorkerPool.default()
+      self._execute_in_pool(func, long_live, pool)
+      return
+    if long_live:
+      if scheduled: func = self._get_event_loop(
+        func, interval, max_rate, on_signal)
+      else: func = self._get_while_loop(func)
     t = threading.Thread(target=func, daemon=daemon)
     self.put_into_pocket('this_thread', t)
     t.start()
 
 
+  def _execute_in_pool(self, func: Callable, long_live: bool,
+                       pool: WorkerPool):
+    done = self.put_into_pocket(self.KEY_DONE_EVENT, threading.Event())
+    stop = self.termination_event
+
+    def step():
+      if long_live and stop.is_set(): return done.set()
+      self.put_into_pocket(
+        self.KEY_STEP_THREAD, threading.current_thread(), exclusive=False)
+      try:
+        if not long_live or self.stats is None: func()
+        else: self.stats.measure(func)
+      except BaseException:
+        done.set()
+        raise
+      finally:
+        self.put_into_pocket(self.KEY_STEP_THREAD, None, exclusive=False)
+      # Long-live nodes go back to the end of the queue after each iteration
+      if long_live: pool.submit(step)
+      else: done.set()
+
+    pool.submit(step)
+
+
   def _get_while_loop(self, func: Callable):
-    def while_loop():
-      while not self.should_terminate:
-        func()
-    return while_loop
+    return _while_loop(func, self.termination_event, self)
+
+
+  def _get_event_loop(self, func: Callable, interval=None, max_rate=None,
+                      on_signal=False):
+    return _event_loop(func, self.termination_event, self.wake_event,
+                       interval, max_rate, on_signal, self)
+
+  # region: Instrumentation
+
+  def instrument(self, enabled: bool = True):
+    """Enable or disable instrumentation of this node and its descendants.
+    Iterations of long-live nodes and batches processed by pipeline workers
+    are recorded. When disabled, each iteration costs only one more attribute
+    check."""
+    self.stats = NodeStats() if enabled else None
+    for node in self.child_nodes: node.instrument(enabled)
+
+
+  def snapshot(self) -> dict:
+    """Get a JSON-serializable snapshot of this node and its descendants"""
+    return {
+      'name': self.name or '{}@{:x}'.format(self.__class__.__name__, id(self)),
+      'type': self.__class__.__name__,
+      'terminated': self.termination_event.is_set(),
+      'stats': None if self.stats is None else self.stats.to_dict(),
+      'children': [node.snapshot() for node in list(self.child_nodes)]}
+
+
+  def stats_json(self, **kwargs) -> str:
+    """Dump the snapshot as a JSON string. `kwargs` go to `json.dumps`"""
+    return json.dumps(self.snapshot(), **kwargs)
+
+
+  def stats_table(self, buffered=False) -> Table:
+    """Render the snapshot into a `Table`, one row per node. Latencies are in
+    milliseconds."""
+    rows = []
+    def _add(snapshot, depth):
+      rows.append(('  ' * depth + snapshot['name'], snapshot['stats']))
+      for child in snapshot['children']: _add(child, depth + 1)
+    _add(self.snapshot(), 0)
+
+    width = min(max([len(name) for name, _ in rows] + [4]), 60)
+    table = Table(width, 10, 9, 9, 9, 9, 6, 16, buffered=buffered)
+    table.specify_format(None, '{:,}', *(['{:.3f}'] * 4), '{:,}', None,
+                         align='lrrrrrrr')
+    table.print_header(
+      'Node', 'Iters', 'Mean', 'P99', 'Max', 'CPU(s)', 'Errs', 'Queues')
+    for name, stats in rows:
+      if stats is None:
+        table.print_row(name, *([''] * 7))
+        continue
+      queues = ' '.join(['{}={}'.format(k, v)
+                         for k, v in stats['queues'].items()])
+      table.print_row(
+        name, stats['iterations'], stats['mean_latency'] * 1000,
+        stats['p99'] * 1000, stats['max_latency'] * 1000,
+        stats['thread_time'], stats['exceptions'], queues)
+    table.hline()
+    return table
+
+
+  def print_stats(self): self.stats_table()
+
+  # endregion: Instrumentation
+
+
+
+class _SharedArray(object):
+  """A NumPy array placed in shared memory by the process producing it. The
+  receiver copies it out and unlinks the memory block."""
+
+  def __init__(self, array):
+    from multiprocessing import resource_tracker, shared_memory
+    import numpy as np
+
+    shm = shared_memory.SharedMemory(create=True, size=array.nbytes)
+    np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+    self.name, self.shape, self.dtype = shm.name, array.shape, array.dtype.str
+    # The block will be unlinked by the receiver, which may be tracked by
+    #   another resource tracker
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    shm.close()
+
+  def load(self):
+    from multiprocessing import shared_memory
+    import numpy as np
+
+    shm = shared_memory.SharedMemory(name=self.name)
+    try: return np.ndarray(self.shape, self.dtype, buffer=shm.buf).copy()
+    finally:
+      shm.close()
+      shm.unlink()
+
+
+def _share(obj, min_size: int):
+  """Replace large NumPy arrays in `obj` with `_SharedArray`s"""
+  # If numpy has not been imported, `obj` can not contain arrays
+  np = sys.modules.get('numpy')
+  if np is None: return obj
+  if isinstance(obj, np.ndarray):
+    if obj.dtype.hasobject or obj.nbytes < max(min_size, 1): return obj
+    return _SharedArray(obj)
+  if isinstance(obj, (list, tuple)):
+    return type(obj)([_share(o, min_size) for o in obj])
+  if isinstance(obj, dict):
+    return {k: _share(v, min_size) for k, v in obj.items()}
+  return obj
+
+
+def _unshare(obj):
+  if isinstance(obj, _SharedArray): return obj.load()
+  if isinstance(obj, (list, tuple)):
+    return type(obj)([_unshare(o) for o in obj])
+  if isinstance(obj, dict): return {k: _unshare(v) for k, v in obj.items()}
+  return obj
+
+
+def _run_in_process(func: Callable, long_live: bool, stop, wake, results,
+                    min_size: int, schedule: dict):
+  def emit():
+    result = func()
+    if result is None: return
+    result = _share(result, min_size)
+    # Results nobody reads are dropped once terminated, otherwise the
+    #   process would block on a full queue forever
+    while True:
+      try: return results.put(result, timeout=0.05)
+      except queue.Full:
+        if stop.is_set(): return _unshare(result)
+
+  if not long_live: emit()
+  elif any(schedule.values()): _event_loop(emit, stop, wake, **schedule)()
+  else: _while_loop(emit, stop)()
+
+
+
+class ProcessXNode(XNode):
+  """XNode executed in a separate process, which is not limited by the GIL.
+  Termination and wake-up signals are propagated through shared events.
+  Non-None values returned by `func` are sent back to the parent process and
+  can be fetched by `get_result`, in which large NumPy arrays are passed
+  through shared memory instead of being pickled.
+
+  Note that `func` should be picklable if the start method is not 'fork'.
+  """
+
+  # Start method of processes, e.g., 'spawn'. Use the default one if None
+  START_METHOD = None
+  # Arrays smaller than this number of bytes are pickled as usual
+  SHARED_MEMORY_THRESHOLD = 1 << 16
+  # Maximum number of results waiting to be fetched by `get_result`
+  MAX_PENDING_RESULTS = 64
+
+  @property
+  def context(self): return multiprocessing.get_context(self.START_METHOD)
+
+
+  @Nomear.property()
+  def termination_event(self): return self.context.Event()
+
+
+  @Nomear.property()
+  def wake_event(self): return self.context.Event()
+
+
+  @Nomear.property()
+  def results(self): return self.context.Queue(self.MAX_PENDING_RESULTS)
+
+
+  @property
+  def process(self) -> multiprocessing.Process:
+    return self.get_from_pocket('this_thread')
+
+
+  def instrument(self, enabled: bool = True):
+    """Iterations run in other processes, thus can not be instrumented"""
+    for node in self.child_nodes: node.instrument(enabled)
+
+
+  def execute_async(self, func: Callable, long_live: bool = True,
+                    daemon: bool = True, pool=None,
+                    interval: Optional[float] = None,
+                    max_rate: Optional[float] = None,
+                    on_signal: bool = False):
+    """Execute `func` in a new process. See `XNode.execute_async`."""
+    if pool: raise ValueError(
+      '!! Pools are not supported by process-backed nodes')
+    schedule = dict(interval=interval, max_rate=max_rate, on_signal=on_signal)
+    p = self.context.Process(
+      target=_run_in_process, daemon=daemon,
+      args=(func, long_live, self.termination_event, self.wake_event,
+            self.results, self.SHARED_MEMORY_THRESHOLD, schedule))
+    # The process plays the role of thread in `terminate`
+    self.put_into_pocket('this_thread', p)
+    p.start()
+
+
+  def get_result(self, block: bool = True, timeout: Optional[float] = None):
+    """Get the next value returned by `func`. Raise `queue.Empty` if no result
+    is available in time."""
+    return _unshare(self.results.get(block, timeout))
+
+
+  def _join(self):
+    """Wait for the process to exit. Unread results are discarded, so that
+    the process can flush its queue and exit, and shared memory blocks of
+    them are unlinked."""
+    p = self.process
+    if p is None: return
+    while p.exitcode is None:
+      self._discard_results()
+      p.join(timeout=0.05)
+    self._discard_results()
+
+
+  def _discard_results(self):
+    while True:
+      try: _unshare(self.results.get(block=False))
+      except queue.Empty: return
+
+
+
+class AsyncXNode(XNode):
+  """XNode executed as an asyncio task. All async nodes share one event loop
+  running in a dedicated thread, so that thousands of I/O-bound nodes cost
+  neither an OS thread nor a stack each. `func` should be a coroutine
+  function, e.g., `async def func(): ...`, which should not block the loop.
+
+  Terminating a node cancels its task and terminates all its children.
+  Coroutines can be submitted to the loop from ordinary threads via `submit`.
+  """
+
+  KEY_FUTURE = 'KEY_FUTURE'
+  KEY_TASK = 'KEY_TASK'
+
+  _loop = None
+  _loop_thread = None
+  _loop_lock = threading.Lock()
+
+  @classmethod
+  def get_loop(cls) -> asyncio.AbstractEventLoop:
+    """Get the event loop shared by all async nodes, starting it if necessary
+    """
+    with AsyncXNode._loop_lock:
+      if AsyncXNode._loop is None:
+        loop = asyncio.new_event_loop()
+        t = threading.Thread(target=loop.run_forever, daemon=True,
+                             name='AsyncXNode')
+        t.start()
+        AsyncXNode._loop, AsyncXNode._loop_thread = loop, t
+      return AsyncXNode._loop
+
+
+  @classmethod
+  def submit(cls, coro: Awaitable) -> Future:
+    """Run `coro` in the shared event loop. This method can be called from any
+    thread. Use `.result()` of the returned future to wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, cls.get_loop())
+
+
+  @property
+  def future(self) -> Future:
+    """Future of the task, from which results of one-shot nodes can be got"""
+    return self.get_from_pocket(self.KEY_FUTURE)
+
+
+  @Nomear.property()
+  def wake_event(self):
+    """Should be accessed only in the event loop thread, since asyncio events
+    are bound to the loop running when they are created on Python < 3.10"""
+    return asyncio.Event()
+
+
+  def wake(self):
+    # The event is created in the loop thread if it does not exist yet
+    self.get_loop().call_soon_threadsafe(lambda: self.wake_event.set())
+
+
+  def terminate(self, block=False):
+    """Terminate this node and all its children. Blocking is not allowed in
+    the event loop thread."""
+    if block and threading.current_thread() is AsyncXNode._loop_thread:
+      raise RuntimeError('!! Can not block the event loop thread')
+    nodes = self._terminate_tree()
+    parent = self.get_from_pocket(self.KEY_PARENT_THREAD)
+    if parent is not None and self in parent.child_nodes:
+      parent.child_nodes.remove(self)
+
+    # Cancel all tasks in one callback
+    futures = [n.get_from_pocket(self.KEY_FUTURE) for n in nodes]
+    futures = [f for f in futures if f is not None]
+    if futures: self.get_loop().call_soon_threadsafe(self._cancel_tasks, nodes)
+    if block: wait(futures)
+
+
+  def _terminate_tree(self) -> list:
+    """Set termination flags of this node and its descendants, and return
+    all of them"""
+    nodes = [self]
+    for node in self.child_nodes: nodes.extend(node._terminate_tree())
+    self.child_nodes.clear()
+    self.put_into_pocket(self.KEY_SHOULD_TERMINATE, True, exclusive=False)
+    self.termination_event.set()
+    return nodes
+
+
+  @classmethod
+  def _cancel_tasks(cls, nodes):
+    # Tasks not started yet will return once they see the termination event
+    for node in nodes:
+      task = node.get_from_pocket(cls.KEY_TASK)
+      if task is not None: task.cancel()
+
+
+  def execute_async(self, func: Callable, long_live: bool = True,
+                    daemon: bool = True, pool=None,
+                    interval: Optional[float] = None,
+                    max_rate: Optional[float] = None,
+                    on_signal: bool = False):
+    """Execute `func` as a task in the shared event loop. See
+    `XNode.execute_async`. `daemon` is ignored."""
+    if pool: raise ValueError('!! Pools are not supported by async nodes')
+    future = self.submit(
+      self._run(func, long_live, interval, max_rate, on_signal))
+    self.put_into_pocket(self.KEY_FUTURE, future)
+
+
+  async def _run(self, func: Callable, long_live: bool, interval, max_rate,
+                 on_signal):
+    stop = self.termination_event
+    if stop.is_set(): return
+    self.put_into_pocket(self.KEY_TASK, asyncio.current_task())
+    if not long_live:
+      result = func()
+      return await result if inspect.isawaitable(result) else result
+
+    wake = self.wake_event if on_signal else None
+    periods = [p for p in (interval, max_rate and 1.0 / max_rate) if p]
+    period = max(periods) if periods else 0
+
+    loop = asyncio.get_running_loop()
+    next_time = loop.time()
+    while not stop.is_set():
+      if on_signal:
+        await wake.wait()
+        wake.clear()
+      if self.stats is None:
+        result = func()
+        if inspect.isawaitable(result): await result
+      else: await self.stats.measure_async(func)
+      # Always yield to other tasks, skipping ticks missed by slow calls
+      next_time += period
+      delay = next_time - loop.time()
+      if delay < 0: next_time, delay = loop.time(), 0
+      await asyncio.sleep(delay)
+
+
+
+class Pipeline(XNode):
+  """A streaming pipeline in which stages are XNodes joined by bounded
+  queues. A stage blocks once its output queue is full, so that memory stays
+  bounded no matter how large the input is. Stages and their workers are
+  children of the pipeline, thus terminating the pipeline or any of its
+  ancestors shuts down the whole pipeline.
+
+  Example:
+
+    pipeline = Pipeline(buffer_size=16)
+    pipeline.add_stage(load, workers=4)
+    pipeline.add_stage(predict, batch_size=32)
+    for y in pipeline.run(paths): ...
+  """
+
+  # Interval in seconds at which blocked workers check termination
+  TICK = 0.05
+
+  class _End(object):
+    """Marks the end of a stream"""
+
+  def __init__(self, buffer_size: int = 64, ordered: bool = True,
+               parent: Optional[XNode] = None):
+    """
+    :param buffer_size: default capacity of the queue before each stage
+    :param ordered: whether to yield outputs in the order of inputs
+    :param parent: if provided, the pipeline will be a child of `parent`
+    """
+    assert buffer_size > 0
+    self.buffer_size = buffer_size
+    self.ordered = ordered
+    self._stages = []
+    if parent is not None:
+      parent.child_nodes.append(self)
+      self.parent_node = parent
+      if parent.stats is not None: self.instrument()
+
+
+  def add_stage(self, func: Callable, workers: int = 1, batch_size: int = 1,
+                buffer_size: Optional[int] = None):
+    """Append a stage to this pipeline.
+
+    :param func: function applied to each item. If `batch_size` > 1, it will
+                 be applied to a list of at most `batch_size` items and should
+                 return a list of outputs of the same length
+    :param workers: number of threads running this stage
+    :param batch_size: maximum number of items processed at once
+    :param buffer_size: capacity of the input queue of this stage
+    :return: this pipeline, so that calls can be chained
+    """
+    assert workers > 0 and batch_size > 0
+    if buffer_size is None: buffer_size = self.buffer_size
+    self._stages.append((func, workers, batch_size, buffer_size))
+    return self
+
+
+  def _put(self, q: queue.Queue, item, stop) -> bool:
+    while not stop.is_set():
+      try:
+        q.put(item, timeout=self.TICK)
+        return True
+      except queue.Full: pass
+    return False
+
+
+  def _new_node(self, parent: XNode, name: str) -> XNode:
+    node = XNode()
+    node.name = name
+    parent.child_nodes.append(node)
+    node.parent_node = parent
+    if parent.stats is not None: node.instrument()
+    return node
+
+
+  def _feed(self, items, q: queue.Queue, stop, abort, slots):
+    try:
+      for seq, item in enumerate(items):
+        # Wait until the number of items in flight drops below the limit
+        while not slots.acquire(timeout=self.TICK):
+          if stop.is_set(): return
+        if not self._put(q, (seq, item), stop): return
+      self._put(q, self._End, stop)
+    except Exception as e: abort(e)
+
+
+  @staticmethod
+  def _apply(func, batch_size, batch):
+    if batch_size == 1: return [func(batch[0][1])]
+    return func([item for _, item in batch])
+
+
+  def _work(self, node, func, batch_size, q_in, q_out, stop, ended, remaining,
+            abort):
+    while not (stop.is_set() or ended.is_set()):
+      try: batch = [q_in.get(timeout=self.TICK)]
+      except queue.Empty: continue
+      while batch[-1] is not self._End and len(batch) < batch_size:
+        try: batch.append(q_in.get_nowait())
+        except queue.Empty: break
+      # The end mark is always the last item in a queue
+      if batch[-1] is self._End:
+        ended.set()
+        batch.pop()
+      if not batch: break
+
+      seqs = [seq for seq, _ in batch]
+      try:
+        if node.stats is None: outputs = self._apply(func, batch_size, batch)
+        else: outputs = node.stats.measure(self._apply, func, batch_size, batch)
+        assert len(outputs) == len(seqs)
+      except Exception as e: return abort(e)
+      for item in zip(seqs, outputs):
+        if not self._put(q_out, item, stop): return
+
+    # The last worker of this stage passes the end mark downstream
+    with remaining['lock']:
+      remaining['count'] -= 1
+      if remaining['count'] > 0: return
+    if ended.is_set(): self._put(q_out, self._End, stop)
+
+
+  def run(self, items: Iterable) -> Iterator:
+    """Feed `items` into this pipeline and yield outputs of the last stage.
+    The pipeline will be shut down once the generator is exhausted or closed.
+    Exceptions raised in stages will be raised here.
+    """
+    assert len(self._stages) > 0
+    queues = [queue.Queue(size) for *_, size in self._stages]
+    queues.append(queue.Queue(self.buffer_size))
+    errors, nodes, workers_nodes = [], [], []
+    # Items fed but not yielded yet are limited, otherwise the reorder buffer
+    #   could grow without limit while an early item is slow
+    slots = threading.Semaphore(
+      sum(q.maxsize for q in queues) + sum(
+        workers * batch_size for _, workers, batch_size, _ in self._stages))
+
+    def abort(e: Exception):
+      errors.append(e)
+      for node in nodes: node.terminate()
 
+    # Create a node for each stage with a child for each worker
+    feeder = self._new_node(self, 'feeder')
+    nodes.append(feeder)
+    for i, (func, workers, batch_size, _) in enumerate(self._stages):
+      stage = self._new_node(self, 'stage-{}'.format(i))
+      nodes.append(stage)
+      if stage.stats is not None:
+        stage.stats.queues.update({'in': queues[i], 'out': queues[i + 1]})
+      ended = threading.Event()
+      remaining = {'count': workers, 'lock': threading.Lock()}
+      for j in range(workers):
+        worker = self._new_node(stage, 'worker-{}'.format(j))
+        workers_nodes.append(worker)
+        worker.execute_async(
+          lambda w=worker, f=func, b=batch_size, i=i,
+                 s=stage.termination_event, e=ended, r=remaining: self._work(
+            w, f, b, queues[i], queues[i + 1], s, e, r, abort),
+          long_live=False)
+    feeder.execute_async(lambda: self._feed(
+      items, queues[0], feeder.termination_event, abort, slots),
+      long_live=False)
 
+    # Yield outputs, buffering those arriving too early if ordered
+    q_out, stop = queues[-1], self.termination_event
+    pending, next_seq = {}, 0
+    try:
+      while not stop.is_set():
+        if errors: raise errors[0]
+        try: item = q_out.get(timeout=self.TICK)
+        except queue.Empty: continue
+        if item is self._End: break
+        if not self.ordered:
+          slots.release()
+          yield item[1]
+          continue
+        pending[item[0]] = item[1]
+        while next_seq in pending:
+          slots.release()
+          yield pending.pop(next_seq)
+          next_seq += 1
+      if errors: raise errors[0]
+    finally:
+      for node in nodes: node.terminate(block=True)
+      # Remove nodes of this run from the Nomear cloud
+      for node in nodes + workers_nodes: node.release()
@@ -14,5 +14,255 @@
 # ===-=====================================================================-===
 """This module provides methods for traveling through file systems.
 """
+from . import finder
+from array import array
+from bisect import bisect_left
+from fnmatch import fnmatchcase
+
 import os
+import pickle
+import re
 import sys
+import zlib
+
+# The parser of `re` was renamed in Python 3.11
+if sys.version_info >= (3, 11):
+  from re import _constants as _re_constants, _parser as _re_parser
+else:
+  import sre_constants as _re_constants, sre_parse as _re_parser
+
+
+def _trigrams(s: str) -> set:
+  s = s.lower()
+  return set([s[i:i + 3] for i in range(len(s) - 2)])
+
+
+def _glob_literals(pattern: str) -> list:
+  """Split a glob pattern into literal fragments which must appear in every
+  matched path"""
+  literals, current = [], []
+  i, n = 0, len(pattern)
+
+  def _cut():
+    if current: literals.append(''.join(current))
+    current.clear()
+
+  while i < n:
+    c = pattern[i]
+    i += 1
+    if c in '*?':
+      _cut()
+    elif c == '[':
+      # Find the end of the set as `fnmatch.translate` does, in which a `]`
+      #   right after `[` or `[!` is a member of the set
+      j = i
+      if j < n and pattern[j] == '!': j += 1
+      if j < n and pattern[j] == ']': j += 1
+      while j < n and pattern[j] != ']': j += 1
+      # An unclosed `[` is literal
+      if j >= n: current.append(c)
+      else:
+        _cut()
+        i = j + 1
+    else: current.append(c)
+  _cut()
+  return literals
+
+
+def _regex_literals(pattern: str) -> list:
+  """Extract literal fragments which must appear in every string matched by
+  the given regular expression. The pattern is parsed by the parser of `re`.
+  This is conservative: an empty list will be returned if alternation is
+  found, and contents of groups, repeats and character sets are skipped."""
+  try: parsed = _re_parser.parse(pattern)
+  except Exception: return []
+  literals, current = [], []
+  for op, av in parsed:
+    # Top-level alternation is represented by a single BRANCH
+    if op is _re_constants.BRANCH: return []
+    if op is _re_constants.LITERAL:
+      current.append(chr(av))
+      continue
+    if current: literals.append(''.join(current))
+    current = []
+  if current: literals.append(''.join(current))
+  return literals
+
+
+class PathIndex(object):
+  """Trigram inverted index over relative paths gathered by `finder`. Each
+  trigram of a (lower-cased) path maps to a sorted array of path ids, so
+  that candidates of a query are found by intersecting a few posting lists
+  before being verified, instead of walking through the whole tree.
+
+  Example:
+
+      index = PathIndex.build(root)
+      index.save('paths.index')
+      index.glob('*resnet*ckpt*')
+      index.search('train_log')
+      index.regex(r'epoch_\\d+\\.pt$')
+
+      # Later
+      index = PathIndex.load('paths.index')
+      index.update()
+  """
+
+  VERSION = 1
+
+  def __init__(self, root_path=None):
+    self.root_path = root_path
+    # id -> path, None for removed paths
+    self._paths = []
+    # path -> id
+    self._ids = {}
+    # trigram -> sorted array of ids
+    self._postings = {}
+
+  # region: Properties
+
+  @property
+  def paths(self): return sorted(self._ids.keys())
+
+  @property
+  def _num_removed(self): return len(self._paths) - len(self._ids)
+
+  # endregion: Properties
+
+  def __len__(self): return len(self._ids)
+
+  def __contains__(self, path): return path in self._ids
+
+  # region: Private Methods
+
+  def _candidates(self, literals):
+    """Return ids of paths containing all trigrams of `literals`, or None if
+    no trigram is available, which means all paths are candidates"""
+    grams = set()
+    for literal in literals: grams.update(_trigrams(literal))
+    if len(grams) == 0: return None
+
+    postings = []
+    for g in grams:
+      if g not in self._postings: return []
+      postings.append(self._postings[g])
+    postings.sort(key=len)
+
+    # Look up ids of the shortest list in the others using bisection
+    candidates = []
+    for i in postings[0]:
+      for posting in postings[1:]:
+        k = bisect_left(posting, i)
+        if k == len(posting) or posting[k] != i: break
+      else: candidates.append(i)
+    return candidates
+
+  def _query(self, literals, match, limit):
+    candidates = self._candidates(literals)
+    if candidates is None: candidates = range(len(self._paths))
+    results = []
+    for i in candidates:
+      path = self._paths[i]
+      if path is None or not match(path): continue
+      results.append(path)
+      if limit is not None and len(results) >= limit: break
+    return sorted(results)
+
+  # endregion: Private Methods
+
+  # region: Public Methods
+
+  def add(self, path: str):
+    """Add a relative path to index"""
+    if path in self._ids: return
+    i = len(self._paths)
+    self._paths.append(path)
+    self._ids[path] = i
+    for g in _trigrams(path):
+      posting = self._postings.get(g)
+      if posting is None: posting = self._postings[g] = array('I')
+      posting.append(i)
+
+  def remove(self, path: str):
+    """Remove a path from index. Its id is released lazily by `compact`."""
+    i = self._ids.pop(path, None)
+    if i is None: return
+    self._paths[i] = None
+    if self._num_removed > max(len(self._ids), 1024): self.compact()
+
+  def compact(self):
+    """Rebuild posting lists to drop removed paths"""
+    paths = [p for p in self._paths if p is not None]
+    self._paths, self._ids, self._postings = [], {}, {}
+    for p in paths: self.add(p)
+
+  def update(self, root_path=None, **kwargs) -> tuple:
+    """Synchronize index with the file system. Relative paths are gathered by
+    `finder.iwalk`, see `finder.walk` for the description of `kwargs`.
+
+    :return: a tuple of (added_paths, removed_paths)
+    """
+    if root_path is None: root_path = self.root_path
+    if root_path is None: raise ValueError('!! `root_path` is not specified')
+    self.root_path = root_path
+    kwargs.setdefault('type_filter', 'file')
+    start = len(root_path.rstrip('/')) + 1
+    current = set([p[start:] for p in finder.iwalk(
+      root_path, recursive=True, **kwargs)])
+    added = sorted(current - set(self._ids.keys()))
+    removed = sorted(set(self._ids.keys()) - current)
+    for p in removed: self.remove(p)
+    for p in added: self.add(p)
+    return added, removed
+
+  @classmethod
+  def build(cls, root_path, **kwargs):
+    """Build an index for `root_path`. See `update` for details."""
+    index = cls(root_path)
+    index.update(**kwargs)
+    return index
+
+  def search(self, substring: str, ignore_case=False, limit=None) -> list:
+    """Find paths containing `substring`"""
+    if ignore_case:
+      substring = substring.lower()
+      match = lambda p: substring in p.lower()
+    else: match = lambda p: substring in p
+    return self._query([substring], match, limit)
+
+  def glob(self, pattern: str, limit=None) -> list:
+    """Find paths matching a glob pattern. Note that `*` also matches `/`."""
+    return self._query(_glob_literals(pattern),
+                       lambda p: fnmatchcase(p, pattern), limit)
+
+  def regex(self, pattern: str, ignore_case=False, limit=None) -> list:
+    """Find paths in which the regular expression can be found"""
+    search = re.compile(pattern, re.IGNORECASE if ignore_case else 0).search
+    return self._query(_regex_literals(pattern),
+                       lambda p: search(p) is not None, limit)
+
+  def save(self, path):
+    """Save index to `path`. Posting lists are saved as raw arrays and the
+    whole file is compressed."""
+    if self._num_removed > 0: self.compact()
+    data = dict(version=self.VERSION, root_path=self.root_path,
+                paths='\0'.join(self._paths),
+                postings={g: p.tobytes() for g, p in self._postings.items()})
+    with open(path, 'wb') as f:
+      f.write(zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL)))
+
+  @classmethod
+  def load(cls, path):
+    """Load an index saved by `save`"""
+    with open(path, 'rb') as f: data = pickle.loads(zlib.decompress(f.read()))
+    if data['version'] != cls.VERSION: raise ValueError(
+      '!! Index version {} is not supported'.format(data['version']))
+    index = cls(data['root_path'])
+    index._paths = data['paths'].split('\0') if data['paths'] else []
+    index._ids = {p: i for i, p in enumerate(index._paths)}
+    for g, b in data['postings'].items():
+      posting = index._postings[g] = array('I')
+      posting.frombytes(b)
+    return index
+
+  # endregion: Public Methods